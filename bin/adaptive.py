@@ -0,0 +1,139 @@
+"""
+Feedback control of the Draco compression settings, trading point density and
+precision for encode time and bandwidth at runtime
+"""
+
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Optional
+
+# Valid Draco compression (speed) levels, 0 = fastest, 10 = smallest
+MIN_COMPRESSION_LEVEL = 0
+MAX_COMPRESSION_LEVEL = 10
+
+# Both measures below this fraction of their target loosen the settings again
+RELAX_FRACTION = 0.7
+
+
+@dataclass(frozen=True)
+class CompressionSettings:
+    """Settings of the compressed point cloud topic"""
+
+    decimate: int
+    quantization_bits: int
+    compression_level: int
+
+
+class CompressionController:
+    """Tunes the compression settings from the measured encode time and output size of
+    every encoded frame.
+
+    Encode time is held below ``encode_budget_s`` and the output bitrate (frame size
+    times frame rate) below ``target_bitrate_bps``, if given. Smoothed measures are
+    compared against the targets and at most one setting is changed by one step at a
+    time, after which ``hold_frames`` new frames are awaited before deciding again:
+
+    - Encode too slow: lower the compression level, then decimate more.
+    - Output too large: raise the compression level while there is encode time to
+      spare, then drop quantization bits, then decimate more.
+    - Both comfortably below target: decimate less, then add quantization bits back,
+      then restore the initial compression level.
+
+    Decimation ranges from the initial one up to ``max_decimate``, quantization bits
+    from ``min_quantization_bits`` up to the initial ones."""
+
+    def __init__(
+        self,
+        initial: CompressionSettings,
+        encode_budget_s: float,
+        frame_rate: float,
+        target_bitrate_bps: Optional[float] = None,
+        max_decimate: int = 8,
+        min_quantization_bits: int = 10,
+        smoothing: float = 0.3,
+        hold_frames: int = 5,
+    ):
+        self.settings = initial
+        self._initial = initial
+        self._encode_budget_s = encode_budget_s
+        self._frame_rate = frame_rate
+        self._target_bitrate_bps = target_bitrate_bps
+        self._max_decimate = max(initial.decimate, max_decimate)
+        self._min_quantization_bits = min(
+            initial.quantization_bits, min_quantization_bits
+        )
+        self._smoothing = smoothing
+        self._hold_frames = hold_frames
+
+        self._encode_s: Optional[float] = None
+        self._bitrate_bps: Optional[float] = None
+        self._frames = 0
+        self._lock = threading.Lock()
+
+    def update(self, encode_s: float, size_bytes: int) -> CompressionSettings:
+        """Feed the measures of one encoded frame, returns the settings to use next"""
+
+        with self._lock:
+            bitrate_bps = size_bytes * 8 * self._frame_rate
+            if self._encode_s is None:
+                self._encode_s, self._bitrate_bps = encode_s, bitrate_bps
+            else:
+                self._encode_s += self._smoothing * (encode_s - self._encode_s)
+                self._bitrate_bps += self._smoothing * (bitrate_bps - self._bitrate_bps)
+
+            self._frames += 1
+            if self._frames < self._hold_frames:
+                return self.settings
+
+            settings = self._decide()
+            if settings != self.settings:
+                logging.info(
+                    "Compression settings %s -> %s (encode %.1f ms, %.2f Mbit/s)",
+                    self.settings,
+                    settings,
+                    self._encode_s * 1e3,
+                    self._bitrate_bps / 1e6,
+                )
+                # Wait for frames encoded with the new settings
+                self.settings = settings
+                self._encode_s = self._bitrate_bps = None
+                self._frames = 0
+
+            return self.settings
+
+    def _decide(self) -> CompressionSettings:
+        current = self.settings
+        encode_load = self._encode_s / self._encode_budget_s
+        bitrate_load = (
+            self._bitrate_bps / self._target_bitrate_bps
+            if self._target_bitrate_bps
+            else 0.0
+        )
+
+        if encode_load > 1:
+            if current.compression_level > MIN_COMPRESSION_LEVEL:
+                return replace(current, compression_level=current.compression_level - 1)
+            if current.decimate < self._max_decimate:
+                return replace(current, decimate=current.decimate + 1)
+
+        elif bitrate_load > 1:
+            if (
+                current.compression_level < MAX_COMPRESSION_LEVEL
+                and encode_load < RELAX_FRACTION
+            ):
+                return replace(current, compression_level=current.compression_level + 1)
+            if current.quantization_bits > self._min_quantization_bits:
+                return replace(current, quantization_bits=current.quantization_bits - 1)
+            if current.decimate < self._max_decimate:
+                return replace(current, decimate=current.decimate + 1)
+
+        elif encode_load < RELAX_FRACTION and bitrate_load < RELAX_FRACTION:
+            if current.decimate > self._initial.decimate:
+                return replace(current, decimate=current.decimate - 1)
+            if current.quantization_bits < self._initial.quantization_bits:
+                return replace(current, quantization_bits=current.quantization_bits + 1)
+            if current.compression_level < self._initial.compression_level:
+                return replace(current, compression_level=current.compression_level + 1)
+
+        return current
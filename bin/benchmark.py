@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the per-frame processing stages of the connector (projection, payload
+building, Draco encoding, enclosing, range image encoding, sector projection) on
+synthetic LidarScans, one run per lidar mode, or on the scans of a recording. Also
+compares the lossless codecs of the raw point cloud topic.
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import itertools
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from ouster.sdk import client
+from ouster.sdk.client import LidarScan
+
+import keelson
+
+import main
+from pcap_index import open_pcap
+from range_image import RangeImageEncoder
+from raw_codec import RAW_CODECS, RawCodec
+from terminal_inputs import CHANNELS, channel_list, level_list
+
+METADATA_FILE = Path(__file__).resolve().parent.parent / "os-992109000253.local.json"
+
+LIDAR_MODES = ("512x10", "512x20", "1024x10", "1024x20", "2048x10", "4096x5")
+
+PERCENTILES = (50, 90, 99)
+
+# Stages making up the processing of one lidar frame, in pipeline order, as the
+# connector runs them. points_to_pointcloud_proto_payload and keelson.enclose, the
+# message-per-frame path the templates replaced, are measured for reference only.
+FRAME_STAGES = (
+    "lidarscan_to_points",
+    "pointcloud_template.enclose",
+    "points_to_compressed_proto_payload",
+)
+
+
+def sensor_info_for_mode(metadata_json: str, lidar_mode: str) -> client.SensorInfo:
+    """Sensor metadata of the bundled sensor as if it was configured in another lidar
+    mode. The per-row pixel shifts are in columns, so they scale with the columns per
+    frame."""
+
+    metadata = json.loads(metadata_json)
+    columns, fps = (int(part) for part in lidar_mode.split("x"))
+
+    data_format = metadata["lidar_data_format"]
+    scale = columns / data_format["columns_per_frame"]
+    data_format["columns_per_frame"] = columns
+    data_format["column_window"] = [0, columns - 1]
+    data_format["fps"] = fps
+    data_format["pixel_shift_by_row"] = [
+        round(shift * scale) for shift in data_format["pixel_shift_by_row"]
+    ]
+    metadata["config_params"]["lidar_mode"] = lidar_mode
+
+    return client.SensorInfo(json.dumps(metadata))
+
+
+def synthetic_lidar_scan(
+    info: client.SensorInfo,
+    rng: np.random.Generator,
+    no_return_fraction: float,
+    fields: Dict[client.ChanField, np.dtype],
+) -> LidarScan:
+    """A complete LidarScan with ``fields`` of a smooth synthetic scene (ranges varying
+    with azimuth and beam, plus noise) where a random fraction of the pixels has no
+    return"""
+
+    h = info.format.pixels_per_column
+    w = info.format.columns_per_frame
+    scan = LidarScan(h, w, fields, info.format.columns_per_packet)
+
+    azimuth = np.linspace(0, 2 * np.pi, w, endpoint=False).reshape(1, -1)
+    beam = np.arange(h).reshape(-1, 1)
+    range_mm = 20000 + 15000 * np.sin(3 * azimuth) + 200 * beam
+    range_mm = range_mm + rng.normal(0, 50, (h, w))
+    range_mm[rng.random((h, w)) < no_return_fraction] = 0
+
+    def _fill(field: client.ChanField, values: np.ndarray):
+        if field not in fields:
+            return
+        channel = scan.field(field)
+        channel[:] = np.clip(values, 0, np.iinfo(channel.dtype).max)
+
+    _fill(client.ChanField.RANGE, range_mm)
+    _fill(client.ChanField.SIGNAL, range_mm / 100 + rng.normal(0, 20, (h, w)))
+    _fill(client.ChanField.REFLECTIVITY, rng.integers(0, 255, (h, w)))
+    _fill(client.ChanField.NEAR_IR, rng.integers(0, 1000, (h, w)))
+
+    scan.timestamp[:] = time.time_ns() + np.arange(w) * int(1e9 / info.format.fps / w)
+    scan.status[:] = 1
+
+    return scan
+
+
+def recorded_lidar_scans(
+    info: client.SensorInfo,
+    pcap_file: str,
+    fields: Dict[client.ChanField, np.dtype],
+    count: int,
+) -> List[LidarScan]:
+    """The first ``count`` complete LidarScans with ``fields`` of a recording"""
+
+    source = open_pcap(pcap_file, info)
+    try:
+        scans = client.Scans(source, complete=True, fields=fields)
+        recorded = list(itertools.islice(scans, count))
+    finally:
+        source.close()
+    if not recorded:
+        raise ValueError(f"No complete scans in {pcap_file}")
+    return recorded
+
+
+def synthetic_imu_data(rng: np.random.Generator) -> Dict[str, Any]:
+    """An IMU sample shaped like the ones yielded by LidarPacketAndIMUPacketScans"""
+
+    return {
+        "acceleration": rng.normal(0, 0.01, 3) + [0, 0, 1],
+        "angular_velocity": rng.normal(0, 0.5, 3),
+        "capture_timestamp": time.time(),
+    }
+
+
+def measure(
+    func: Callable[[int], Any], repeats: int, warmup: int
+) -> Tuple[Dict[str, Any], List[Any]]:
+    """Time ``func(i)`` for i in range(repeats) after ``warmup`` untimed calls.
+    Returns latency statistics, the peak Python/numpy heap allocated by one call and
+    the results of the timed calls."""
+
+    for i in range(warmup):
+        func(i)
+
+    results = []
+    latencies = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        results.append(func(i))
+        latencies[i] = time.perf_counter() - start
+
+    # Separate call, tracemalloc slows down everything it traces
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    func(0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies_ms = latencies * 1e3
+    stats = {
+        "ms": {
+            "mean": float(latencies_ms.mean()),
+            **{
+                f"p{percentile}": float(np.percentile(latencies_ms, percentile))
+                for percentile in PERCENTILES
+            },
+            "max": float(latencies_ms.max()),
+        },
+        "alloc_bytes": peak - baseline,
+    }
+    return stats, results
+
+
+def benchmark_raw_codecs(
+    points: List[np.ndarray], args: argparse.Namespace
+) -> Dict[str, Dict[str, Any]]:
+    """Compression ratio against encode and decode latency of every lossless codec of
+    the raw point cloud topic, with and without byte shuffling, cycling through the
+    points of several scans"""
+
+    results = {}
+    for codec, shuffle in itertools.product(RAW_CODECS[1:], (True, False)):
+        try:
+            raw_codec = RawCodec(codec, args.raw_codec_level, shuffle)
+        except ImportError as error:
+            logging.warning("Skipping raw codec %s: %s", codec, error)
+            continue
+
+        # The codec and its output bound as defaults, not looked up per call
+        encode, encoded = measure(
+            lambda i, raw_codec=raw_codec: raw_codec.encode(points[i % len(points)]),
+            args.frames,
+            args.warmup,
+        )
+        decode, decoded = measure(
+            lambda i, raw_codec=raw_codec, encoded=encoded: raw_codec.decode(
+                encoded[i % len(points)], points[i % len(points)].dtype
+            ),
+            args.frames,
+            0,
+        )
+        if not np.array_equal(decoded[0], points[0]):
+            raise AssertionError(f"Raw codec {codec} is not lossless")
+
+        # Per frame
+        bytes_in = np.mean([points[i % len(points)].nbytes for i in range(args.frames)])
+        bytes_out = np.mean([len(data) for data in encoded])
+        results[f"{codec}+shuffle" if shuffle else codec] = {
+            "level": raw_codec.level,
+            "ratio": float(bytes_in / max(1, bytes_out)),
+            "bytes_out": int(bytes_out),
+            "encode": encode,
+            "decode": decode,
+            "encode_mb_per_s": float(bytes_in / 1e3 / encode["ms"]["mean"]),
+            "decode_mb_per_s": float(bytes_in / 1e3 / decode["ms"]["mean"]),
+        }
+    return results
+
+
+def benchmark_mode(
+    metadata_json: str, lidar_mode: str, args: argparse.Namespace
+) -> Dict[str, Any]:
+    """Benchmark every stage for one lidar mode"""
+
+    rng = np.random.default_rng(args.seed)
+
+    if args.pcap_file is not None:
+        info = client.SensorInfo(metadata_json)
+        scans = recorded_lidar_scans(
+            info,
+            args.pcap_file,
+            main.scan_fields(info, args),
+            min(args.frames, args.distinct_scans),
+        )
+    else:
+        info = sensor_info_for_mode(metadata_json, lidar_mode)
+        scans = [
+            synthetic_lidar_scan(
+                info, rng, args.no_return_fraction, main.scan_fields(info, args)
+            )
+            for _ in range(min(args.frames, args.distinct_scans))
+        ]
+    imu_samples = [synthetic_imu_data(rng) for _ in range(args.frames)]
+
+    projector = main.make_projector(info, args)
+    stages: Dict[str, Dict[str, Any]] = {}
+
+    def _project(i: int) -> int:
+        points = main.lidarscan_to_points(scans[i % len(scans)], projector)
+        projector.release(points)
+        return len(points)
+
+    stages["lidarscan_to_points"], kept = measure(_project, args.frames, args.warmup)
+
+    sector_projector = main.make_sector_projector(info, args)
+    if sector_projector is not None:
+
+        def _project_sectors(i: int) -> int:
+            kept = 0
+            for projector in sector_projector.projectors:
+                points = projector.project(scans[i % len(scans)])
+                projector.release(points)
+                kept += len(points)
+            return kept
+
+        stages["lidarscan_to_sector_points"], sector_kept = measure(
+            _project_sectors, args.frames, args.warmup
+        )
+        stages["lidarscan_to_sector_points"]["bytes_out"] = (
+            int(np.mean(sector_kept)) * projector.dtype.itemsize
+        )
+
+    # The payload stages work on the points of the first scan, projected once
+    points = main.lidarscan_to_points(scans[0], projector)
+
+    def _raw_payload(_: int) -> bytes:
+        payload = main.points_to_pointcloud_proto_payload(
+            points, scans[0], args.frame_id
+        )
+        return payload.SerializeToString()
+
+    stages["points_to_pointcloud_proto_payload"], raw = measure(
+        _raw_payload, args.frames, args.warmup
+    )
+
+    def _compressed_payload(_: int) -> bytes:
+        payload = main.points_to_compressed_proto_payload(points, scans[0], args)
+        return payload.SerializeToString()
+
+    stages["points_to_compressed_proto_payload"], compressed = measure(
+        _compressed_payload, args.frames, args.warmup
+    )
+
+    if args.lod:
+        # All levels of detail from one reduction, against one reduction per level
+        def _lod_encode(reduced: Dict[int, np.ndarray]) -> int:
+            size = 0
+            for level_points in reduced.values():
+                xyz, generic_attributes = main.points_to_draco_arrays(level_points)
+                size += len(
+                    main.draco_encode(
+                        xyz,
+                        generic_attributes,
+                        args.quantization_bits,
+                        args.compression_level,
+                    )
+                )
+            return size
+
+        decimates = tuple(args.decimate * level for level in args.lod)
+        stages["lod_payloads"], lod = measure(
+            lambda _: _lod_encode(main.reduce_points_levels(points, decimates, args)),
+            args.frames,
+            args.warmup,
+        )
+        stages["lod_payloads_separately"], separately = measure(
+            lambda _: _lod_encode(
+                {
+                    decimate: main.reduce_points(points, decimate, args)
+                    for decimate in decimates
+                }
+            ),
+            args.frames,
+            args.warmup,
+        )
+        stages["lod_payloads"]["bytes_out"] = lod[0]
+        stages["lod_payloads_separately"]["bytes_out"] = separately[0]
+
+    def _enclose(_: int) -> bytes:
+        return keelson.enclose(raw[0])
+
+    stages["keelson.enclose"], enclosed = measure(_enclose, args.frames, args.warmup)
+
+    # What the connector publishes instead: payload and envelope written in one pass
+    def _template_enclose(_: int) -> bytes:
+        template = main.pointcloud_template(points.dtype, args.frame_id)
+        return template.enclose(
+            int(scans[0].timestamp[0]), main.points_to_pointcloud_data(points)
+        )
+
+    stages["pointcloud_template.enclose"], template_enclosed = measure(
+        _template_enclose, args.frames, args.warmup
+    )
+
+    def _imu_payload(i: int) -> int:
+        payload_acc, payload_ang = main.imu_data_to_imu_proto_payload(
+            imu_samples[i % len(imu_samples)], args
+        )
+        return len(payload_acc.SerializeToString()) + len(
+            payload_ang.SerializeToString()
+        )
+
+    stages["imu_data_to_imu_proto_payload"], imu = measure(
+        _imu_payload, args.frames, args.warmup
+    )
+
+    # What the connector publishes instead: both envelopes written from a template
+    def _imu_envelopes(i: int) -> int:
+        envelopes = main.imu_data_to_imu_envelopes(imu_samples[i % len(imu_samples)])
+        return sum(len(envelope) for envelope in envelopes)
+
+    stages["imu_data_to_imu_envelopes"], imu_envelopes = measure(
+        _imu_envelopes, args.frames, args.warmup
+    )
+
+    range_image_encoder = RangeImageEncoder(
+        info, args.range_image_resolution, args.range_image_level, args.fields
+    )
+
+    def _range_images(i: int) -> int:
+        images = range_image_encoder.encode(scans[i % len(scans)])
+        return sum(len(data) for data in images.values())
+
+    stages["lidarscan_to_range_images"], range_images = measure(
+        _range_images, args.frames, args.warmup
+    )
+
+    # Copies, the projector hands out the same buffers again
+    scan_points = []
+    for scan in scans:
+        projected = main.lidarscan_to_points(scan, projector)
+        scan_points.append(projected.copy())
+        projector.release(projected)
+    raw_codecs = benchmark_raw_codecs(scan_points, args)
+
+    stages["lidarscan_to_points"]["bytes_out"] = int(np.mean(kept)) * points.itemsize
+    stages["points_to_pointcloud_proto_payload"]["bytes_out"] = len(raw[0])
+    stages["points_to_compressed_proto_payload"]["bytes_out"] = len(compressed[0])
+    stages["keelson.enclose"]["bytes_out"] = len(enclosed[0])
+    stages["pointcloud_template.enclose"]["bytes_out"] = len(template_enclosed[0])
+    stages["imu_data_to_imu_proto_payload"]["bytes_out"] = imu[0]
+    stages["imu_data_to_imu_envelopes"]["bytes_out"] = imu_envelopes[0]
+    stages["lidarscan_to_range_images"]["bytes_out"] = int(np.mean(range_images))
+
+    frame_ms = sum(stages[stage]["ms"]["mean"] for stage in FRAME_STAGES)
+    return {
+        "pixels": info.format.pixels_per_column * info.format.columns_per_frame,
+        "points": int(np.mean(kept)),
+        "fps": info.format.fps,
+        "stages": stages,
+        "raw_codecs": raw_codecs,
+        "frame_ms": frame_ms,
+        "frames_per_sec_per_core": 1e3 / frame_ms,
+    }
+
+
+def print_results(results: Dict[str, Any]):
+    """Human readable summary of the results"""
+
+    for lidar_mode, result in results["modes"].items():
+        print(
+            f"{lidar_mode}: {result['points']} points, "
+            f"{result['frame_ms']:.2f} ms/frame, "
+            f"{result['frames_per_sec_per_core']:.1f} frames/s per core "
+            f"(sensor: {result['fps']} frames/s)"
+        )
+        for stage, stats in result["stages"].items():
+            ms = stats["ms"]
+            print(
+                f"  {stage:<36} mean {ms['mean']:8.3f} p50 {ms['p50']:8.3f} "
+                f"p99 {ms['p99']:8.3f} ms | alloc {stats['alloc_bytes'] / 1e6:7.2f} MB "
+                f"| out {stats['bytes_out'] / 1e6:7.3f} MB"
+            )
+        for codec, stats in result["raw_codecs"].items():
+            print(
+                f"  raw {codec:<32} ratio {stats['ratio']:6.2f} "
+                f"encode {stats['encode']['ms']['mean']:8.3f} ms "
+                f"({stats['encode_mb_per_s']:7.1f} MB/s) "
+                f"decode {stats['decode']['ms']['mean']:8.3f} ms "
+                f"({stats['decode_mb_per_s']:7.1f} MB/s)"
+            )
+
+
+def terminal_inputs() -> argparse.Namespace:
+    """Parse the terminal inputs and return the arguments"""
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--log-level",
+        type=int,
+        default=30,
+        help="Log level 10=DEBUG, 20=INFO, 30=WARNING, 40=ERROR, 50=CRITICAL 0=NOTSET",
+    )
+    parser.add_argument(
+        "--metadata-file",
+        type=str,
+        default=str(METADATA_FILE),
+        help="Sensor metadata the synthetic scans are based on, or of --pcap-file",
+    )
+    parser.add_argument(
+        "-p",
+        "--pcap-file",
+        type=str,
+        default=None,
+        help="Benchmark the scans of this recording (in the lidar mode it was "
+        "recorded in) instead of synthetic ones",
+    )
+    parser.add_argument(
+        "--lidar-mode",
+        type=str,
+        action="append",
+        choices=LIDAR_MODES,
+        help="Lidar mode(s) to benchmark, all of them if not given",
+    )
+    parser.add_argument("--frames", type=int, default=20, help="Timed calls per stage")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per stage")
+    parser.add_argument(
+        "--distinct-scans",
+        type=int,
+        default=4,
+        help="Number of different synthetic scans cycled through",
+    )
+    parser.add_argument(
+        "--no-return-fraction",
+        type=float,
+        default=0.3,
+        help="Fraction of pixels without a return in the synthetic scans",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Write the results as JSON to this file",
+    )
+
+    # Processing options, as for the connector itself
+    parser.add_argument("-f", "--frame-id", type=str, default=None)
+    parser.add_argument(
+        "--point-layout", type=str, default="float64", choices=["float64", "packed"]
+    )
+    parser.add_argument("--fields", type=channel_list, default=CHANNELS)
+    parser.add_argument("--drop-invalid", action="store_true")
+    parser.add_argument("--min-range", type=float, default=0.0)
+    parser.add_argument("--max-range", type=float, default=None)
+    parser.add_argument("--decimate", type=int, default=1)
+    parser.add_argument("--lod", type=level_list, default=None)
+    parser.add_argument(
+        "--reduction", type=str, default="stride", choices=["stride", "voxel"]
+    )
+    parser.add_argument("--voxel-size", type=float, default=0.1)
+    parser.add_argument(
+        "--voxel-mode", type=str, default="centroid", choices=["centroid", "first"]
+    )
+    parser.add_argument("--quantization-bits", type=int, default=14)
+    parser.add_argument("--compression-level", type=int, default=7)
+    parser.add_argument("--sector-packets", type=int, default=0)
+    parser.add_argument("--range-image-resolution", type=int, default=8)
+    parser.add_argument("--range-image-level", type=int, default=1)
+    parser.add_argument("--raw-codec-level", type=int, default=None)
+
+    return parser.parse_args()
+
+
+def run():
+    """Benchmark the requested lidar modes, print and optionally save the results"""
+
+    args = terminal_inputs()
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s", level=args.log_level
+    )
+
+    with open(args.metadata_file, "r") as f:
+        metadata_json = f.read()
+
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("log_level", "output")
+    }
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "config": config,
+        "modes": {},
+    }
+
+    lidar_modes = args.lidar_mode or LIDAR_MODES
+    if args.pcap_file is not None:
+        lidar_modes = [json.loads(metadata_json)["config_params"]["lidar_mode"]]
+
+    for lidar_mode in lidar_modes:
+        logging.info("Benchmarking lidar mode %s", lidar_mode)
+        results["modes"][lidar_mode] = benchmark_mode(metadata_json, lidar_mode, args)
+
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        logging.info("Wrote results to %s", args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,307 @@
+"""
+Offline conversion of pcap recordings to MCAP files: the point clouds and IMU samples
+of a recording written as the foxglove/keelson messages the connector would publish,
+with the frames projected and encoded on a pool of worker processes, without zenoh
+"""
+
+import time
+import logging
+import argparse
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from google.protobuf.descriptor import FileDescriptor
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+from mcap.writer import Writer
+from ouster.sdk import client
+
+import keelson
+from keelson.payloads.Decomposed3DVector_pb2 import Decomposed3DVector
+from keelson.payloads.foxglove.PointCloud_pb2 import PointCloud
+from keelson.payloads.foxglove.CompressedPointCloud_pb2 import CompressedPointCloud
+
+from main import (
+    KEELSON_SUBJECT_ACC,
+    KEELSON_SUBJECT_ANG,
+    KEELSON_SUBJECT_POINT_CLOUD,
+    KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED,
+    LidarPacketAndIMUPacketScans,
+    imu_data_to_imu_proto_payload,
+    lidarscan_to_points,
+    make_projector,
+    make_raw_codec,
+    point_cloud_source_id,
+    points_to_compressed_proto_payload,
+    points_to_pointcloud_proto_payload,
+    point_channels,
+    scan_fields,
+)
+from encoding import EncodePool
+from pcap_index import open_pcap
+from projection import POINT_CHANNELS, Projector
+from raw_codec import RawCodec
+
+# Scan field of every channel shipped to the workers, by name
+SCAN_CHANNELS = {"range": client.ChanField.RANGE, **POINT_CHANNELS}
+
+# Frames between progress reports
+PROGRESS_INTERVAL = 100
+
+
+class ScanChannels:
+    """Stand-in for a LidarScan in the worker processes: the (staggered) channels the
+    points are projected from and the column timestamps, all plain numpy arrays so
+    they are cheap to pickle"""
+
+    _names = {field: name for name, field in SCAN_CHANNELS.items()}
+
+    def __init__(self, channels: Dict[str, np.ndarray], timestamp: np.ndarray):
+        self.channels = channels
+        self.timestamp = timestamp
+
+    @classmethod
+    def of(cls, lidar_scan: client.LidarScan, names) -> "ScanChannels":
+        return cls(
+            {name: lidar_scan.field(SCAN_CHANNELS[name]) for name in names},
+            lidar_scan.timestamp,
+        )
+
+    def field(self, field: client.ChanField) -> np.ndarray:
+        return self.channels[self._names[field]]
+
+
+# Projector and raw codec of every sensor seen by a worker process, by metadata
+_converters: Dict[str, Tuple[Projector, Optional[RawCodec]]] = {}
+
+
+def convert_frame(
+    metadata_json: str, args: argparse.Namespace, scan: ScanChannels
+) -> Tuple[int, Optional[bytes], Optional[bytes]]:
+    """Project one frame and build its serialized raw and/or compressed point cloud
+    payloads, as selected with --point-cloud-format, stamped with the first column.
+    Module level so it can be shipped to worker processes, which keep the projector
+    of the sensor across frames."""
+
+    if metadata_json not in _converters:
+        metadata = client.SensorInfo(metadata_json)
+        _converters[metadata_json] = (
+            make_projector(metadata, args),
+            make_raw_codec(args),
+        )
+    projector, raw_codec = _converters[metadata_json]
+
+    points = lidarscan_to_points(scan, projector)
+    try:
+        raw = compressed = None
+        if args.point_cloud_format in ("raw", "both"):
+            raw = points_to_pointcloud_proto_payload(
+                points, scan, args.frame_id, raw_codec=raw_codec
+            ).SerializeToString()
+        # The Draco encoder rejects empty point clouds
+        if args.point_cloud_format in ("compressed", "both") and len(points):
+            compressed = points_to_compressed_proto_payload(
+                points, scan, args
+            ).SerializeToString()
+    finally:
+        projector.release(points)
+
+    return int(scan.timestamp[0]), raw, compressed
+
+
+def file_descriptor_set(descriptor: FileDescriptor) -> bytes:
+    """Serialized FileDescriptorSet of a proto file and everything it imports, the
+    MCAP schema of its protobuf messages"""
+
+    descriptors = FileDescriptorSet()
+    seen = set()
+
+    def _add(file: FileDescriptor):
+        if file.name in seen:
+            return
+        seen.add(file.name)
+        for dependency in file.dependencies:
+            _add(dependency)
+        file.CopyToProto(descriptors.file.add())
+
+    _add(descriptor)
+    return descriptors.SerializeToString()
+
+
+class McapPayloadWriter:
+    """Writes serialized protobuf payloads to an MCAP file, one channel per topic,
+    from any thread"""
+
+    def __init__(self, writer: Writer):
+        self._writer = writer
+        self._schemas: Dict[str, int] = {}
+        self._channels: Dict[str, int] = {}
+        self._sequence: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.messages = 0
+
+    def add_channel(
+        self, topic: str, message_type, metadata: Optional[Dict[str, str]] = None
+    ):
+        """Declare ``topic`` carrying messages of the protobuf ``message_type``,
+        described by the channel ``metadata``"""
+
+        name = message_type.DESCRIPTOR.full_name
+        with self._lock:
+            if name not in self._schemas:
+                self._schemas[name] = self._writer.register_schema(
+                    name=name,
+                    encoding="protobuf",
+                    data=file_descriptor_set(message_type.DESCRIPTOR.file),
+                )
+            self._channels[topic] = self._writer.register_channel(
+                topic=topic,
+                message_encoding="protobuf",
+                schema_id=self._schemas[name],
+                metadata=metadata or {},
+            )
+            self._sequence[topic] = 0
+
+    def write(self, topic: str, timestamp_ns: int, data: bytes):
+        """Write one serialized payload, logged at ``timestamp_ns``"""
+
+        with self._lock:
+            self._writer.add_message(
+                channel_id=self._channels[topic],
+                log_time=timestamp_ns,
+                publish_time=timestamp_ns,
+                sequence=self._sequence[topic],
+                data=data,
+            )
+            self._sequence[topic] += 1
+            self.messages += 1
+
+
+def to_mcap(session, args: argparse.Namespace):
+    """Convert a pcap recording to an MCAP file with the raw and/or compressed point
+    clouds and IMU samples, on the topics the connector publishes them on. Frames are
+    projected and encoded on --workers processes and written in recording order.
+    Messages are logged at their sensor timestamps, on the clock timestamp_mode
+    selects: the column timestamps of the point clouds, accel_ts/gyro_ts of the IMU
+    samples. A --raw-codec is recorded in the metadata of the raw channel. Offline,
+    runs without a zenoh ``session``."""
+
+    def _key(subject: str, source_id: str = args.source_id) -> str:
+        return keelson.construct_pubsub_key(
+            base_path=args.realm,
+            entity_id=args.entity_id,
+            subject=subject,
+            source_id=source_id,
+        )
+
+    point_cloud_topic = _key(KEELSON_SUBJECT_POINT_CLOUD, point_cloud_source_id(args))
+    point_cloud_compressed_topic = _key(KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED)
+    imu_topic_acc = _key(KEELSON_SUBJECT_ACC)
+    imu_topic_ang = _key(KEELSON_SUBJECT_ANG)
+
+    with open(args.metadata_file, "r") as f:
+        metadata_json = f.read()
+    metadata = client.SensorInfo(metadata_json)
+    logging.info("Read metadata from %s", args.metadata_file)
+
+    pcap_source = open_pcap(args.pcap_file, metadata, start=args.start, end=args.end)
+    scans = LidarPacketAndIMUPacketScans(
+        source=pcap_source, timeout=None, fields=scan_fields(metadata, args)
+    )
+    channel_names = ("range", *point_channels(args))
+
+    # Without the function picked by the subcommand, which need not pickle
+    job_args = argparse.Namespace(
+        **{key: value for key, value in vars(args).items() if key != "func"}
+    )
+
+    encode_pool = EncodePool(args.workers, "process")
+    logging.info("Converting %s with %d workers", args.pcap_file, args.workers)
+
+    frames = 0
+    start = time.monotonic()
+
+    with open(args.output, "wb") as f:
+        writer = Writer(f)
+        writer.start(profile="", library="keelson-connector-lidar-os")
+        output = McapPayloadWriter(writer)
+
+        # How the raw point data is compressed, with the channel it applies to
+        raw_codec = make_raw_codec(args)
+        if args.point_cloud_format in ("raw", "both"):
+            output.add_channel(
+                point_cloud_topic,
+                PointCloud,
+                (
+                    None
+                    if raw_codec is None
+                    else {
+                        "raw_codec": raw_codec.codec,
+                        "level": str(raw_codec.level),
+                        "shuffle": str(raw_codec.shuffle).lower(),
+                    }
+                ),
+            )
+        if args.point_cloud_format in ("compressed", "both"):
+            output.add_channel(point_cloud_compressed_topic, CompressedPointCloud)
+        output.add_channel(imu_topic_acc, Decomposed3DVector)
+        output.add_channel(imu_topic_ang, Decomposed3DVector)
+
+        writer.add_metadata("sensor_info", {"json": metadata_json})
+
+        def _on_converted(result: Tuple[int, Optional[bytes], Optional[bytes]]):
+            timestamp_ns, raw, compressed = result
+            if raw is not None:
+                output.write(point_cloud_topic, timestamp_ns, raw)
+            if compressed is not None:
+                output.write(point_cloud_compressed_topic, timestamp_ns, compressed)
+
+        try:
+            for imu_data, lidar_scan in scans:
+                if imu_data is not None:
+                    payload_acc, payload_ang = imu_data_to_imu_proto_payload(
+                        imu_data, args
+                    )
+                    # Logged on the clock of the column timestamps, as the point
+                    # clouds are
+                    output.write(
+                        imu_topic_acc,
+                        int(imu_data["accel_timestamp"]),
+                        payload_acc.SerializeToString(),
+                    )
+                    output.write(
+                        imu_topic_ang,
+                        int(imu_data["gyro_timestamp"]),
+                        payload_ang.SerializeToString(),
+                    )
+
+                if lidar_scan is not None and args.point_cloud_format != "none":
+                    encode_pool.submit(
+                        _on_converted,
+                        convert_frame,
+                        metadata_json,
+                        job_args,
+                        ScanChannels.of(lidar_scan, channel_names),
+                    )
+                    frames += 1
+                    if frames % PROGRESS_INTERVAL == 0:
+                        logging.info(
+                            "Converted %d scans at %.1f frames/s",
+                            frames,
+                            frames / (time.monotonic() - start),
+                        )
+        finally:
+            encode_pool.close()
+            scans.close()
+            writer.finish()
+
+    elapsed = time.monotonic() - start
+    logging.info(
+        "Wrote %d scans (%d messages, %d failed) to %s in %.2f s (%.1f frames/s)",
+        frames,
+        output.messages,
+        encode_pool.failed,
+        args.output,
+        elapsed,
+        frames / elapsed if elapsed > 0 else 0.0,
+    )
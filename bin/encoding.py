@@ -0,0 +1,182 @@
+"""
+Draco encoding of point clouds, optionally fanned out over a pool of worker processes
+(or threads) while results are handed back in submission order
+"""
+
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import DracoPy
+
+ENCODE_BACKENDS = ("process", "thread")
+
+
+def draco_encode(
+    xyz: np.ndarray,
+    generic_attributes: Dict[str, np.ndarray],
+    quantization_bits: int,
+    compression_level: int,
+) -> bytes:
+    """Draco-encode an (N, 3) float32 POSITION array with named (N, 1) float32
+    generic attributes. Module level so it can be shipped to worker processes."""
+
+    return DracoPy.encode(
+        xyz,
+        quantization_bits=quantization_bits,
+        compression_level=compression_level,
+        preserve_order=True,
+        generic_attributes=generic_attributes,
+    )
+
+
+def timed_draco_encode(
+    xyz: np.ndarray,
+    generic_attributes: Dict[str, np.ndarray],
+    quantization_bits: int,
+    compression_level: int,
+) -> Tuple[bytes, float]:
+    """``draco_encode`` returning the encoded bytes together with the time spent
+    encoding, as measured by the worker itself (so without any queueing)"""
+
+    start = time.perf_counter()
+    data = draco_encode(xyz, generic_attributes, quantization_bits, compression_level)
+    return data, time.perf_counter() - start
+
+
+class EncodePool:
+    """Runs encode jobs on a pool of workers and delivers their results in the order
+    the jobs were submitted, per stream: jobs of different streams (e.g. sensors
+    sharing the pool) do not wait for each other.
+
+    ``workers=0`` runs every job inline on the submitting thread. Otherwise at most
+    ``max_pending`` jobs are in flight; submitting more blocks the caller until the
+    oldest one is done, so back-pressure ends up in the (drop-oldest) pipeline queue
+    in front of the caller and stale frames are dropped there rather than piling up.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        backend: str = "process",
+        max_pending: Optional[int] = None,
+    ):
+        if backend not in ENCODE_BACKENDS:
+            raise ValueError(f"Unknown encode backend: {backend}")
+
+        self.workers = max(0, workers)
+        self._executor: Optional[Executor] = None
+        if self.workers and backend == "process":
+            # forkserver: never fork the (multi-threaded) zenoh/ouster parent process
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("forkserver")
+            )
+        elif self.workers:
+            # Only gives a speed-up where the encoder releases the GIL
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="encode"
+            )
+
+        self._max_pending = max_pending or 2 * max(1, self.workers)
+        self._pending: Dict[Hashable, Deque[Tuple[Future, Callable[[Any], None]]]] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._deliver_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs submitted but not yet delivered"""
+        return self._in_flight
+
+    def submit(
+        self,
+        on_done: Callable[[Any], None],
+        fn: Callable,
+        *args,
+        stream: Hashable = None,
+    ):
+        """Run ``fn(*args)`` on the pool and call ``on_done(result)`` once it, and
+        every job submitted before it on the same ``stream``, has finished."""
+
+        with self._lock:
+            self.submitted += 1
+
+        if self._executor is None:
+            self._deliver(on_done, fn(*args))
+            return
+
+        with self._slot_free:
+            while self._in_flight >= self._max_pending:
+                self._slot_free.wait()
+
+            future = self._executor.submit(fn, *args)
+            self._pending.setdefault(stream, deque()).append((future, on_done))
+            self._in_flight += 1
+
+        future.add_done_callback(lambda _: self._drain())
+
+    def _next_done(self) -> Optional[Tuple[Future, Callable[[Any], None]]]:
+        # The oldest job of any stream, if it has finished
+        with self._slot_free:
+            for pending in self._pending.values():
+                if pending and pending[0][0].done():
+                    self._in_flight -= 1
+                    self._slot_free.notify_all()
+                    return pending.popleft()
+        return None
+
+    def _drain(self):
+        # Deliveries happen from whichever thread completed a job, serialized and in
+        # submission order per stream: only the leading runs of finished jobs are
+        # handed out.
+        with self._deliver_lock:
+            while True:
+                job = self._next_done()
+                if job is None:
+                    return
+                future, on_done = job
+
+                try:
+                    result = future.result()
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    # Not logging.exception: a broken pool fails every pending job
+                    # with the same exception object, whose traceback keeps growing
+                    logging.error("Encode job failed: %r", exc)
+                    self.failed += 1
+                    continue
+
+                self._deliver(on_done, result)
+
+    def _deliver(self, on_done: Callable[[Any], None], result: Any):
+        try:
+            on_done(result)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Failed to deliver encoded result")
+            self.failed += 1
+            return
+        self.completed += 1
+
+    def close(self):
+        """Wait for all in-flight jobs, deliver their results and stop the workers"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._drain()
+
+    def stats(self) -> Dict[str, Any]:
+        """Worker count and job counters of the pool"""
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -3,6 +3,7 @@
 """
 Command line utility tool for reading lidar data from an Ouster sensor or a pcap file and pushing to keelson
 """
+import os
 import sys
 import time
 import json
@@ -10,27 +11,46 @@ import atexit
 import logging
 import argparse
 import warnings
+import functools
+import threading
 from contextlib import closing
-from typing import cast, Iterator, Tuple, Optional, Dict
+from typing import cast, Callable, Iterator, Tuple, Optional, Dict, List, Set, Union
+from dataclasses import asdict
 import math
+import socket
 
 import zenoh
 import numpy as np
-import DracoPy
 from ouster.sdk import client
 from ouster.sdk.client import _client
+from ouster.sdk.client.core import SensorConnection
 from ouster.sdk.client import ClientTimeout, Sensor, LidarPacket, ImuPacket, LidarScan
 
 import keelson
 from keelson.payloads.Decomposed3DVector_pb2 import Decomposed3DVector
+from keelson.payloads.Primitives_pb2 import TimestampedString
 from keelson.payloads.foxglove.PointCloud_pb2 import PointCloud
 from keelson.payloads.foxglove.PackedElementField_pb2 import PackedElementField
 from keelson.payloads.foxglove.CompressedPointCloud_pb2 import CompressedPointCloud
-
-
-from ouster.sdk import pcap
-
-import terminal_inputs
+from keelson.payloads.foxglove.CompressedImage_pb2 import CompressedImage
+
+
+from pipeline import Pipeline
+from encoding import EncodePool, draco_encode, timed_draco_encode
+from adaptive import CompressionController, CompressionSettings
+from projection import POINT_CHANNELS, Projector, SectorProjector
+from voxel import voxel_downsample, voxel_downsample_levels
+from range_image import RangeImageEncoder
+from raw_codec import RawCodec
+from replay import PacedPacketSource
+from pcap_index import open_pcap
+from matching import close_watches, subscribed, watch_publisher
+from serialization import MessageTemplate, enclose, encode_vector3
+from shm_publisher import ShmPublisher, make_shm_provider
+from udp_source import UdpPacketSource
+from sensor_cache import SensorCache, config_changes
+from scan_pool import ScanPool
+from metrics import Metrics
 
 
 KEELSON_SUBJECT_POINT_CLOUD = "point_cloud"
@@ -38,13 +58,105 @@ KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED = "point_cloud_compressed"
 KEELSON_SUBJECT_ACC = "linear_acceleration_mpss"
 KEELSON_SUBJECT_ANG = "angular_velocity_radps"
 KEELSON_SUBJECT_CONFIG = "sensor_config"
+KEELSON_SUBJECT_METRICS = "connector_metrics"
+KEELSON_SUBJECT_IMAGE_COMPRESSED = "image_compressed"
+KEELSON_SUBJECT_CONFIGURATION = "configuration_json"
+
+# IMU samples waiting for the IMU publishing thread before the oldest is dropped
+IMU_QUEUE_SIZE = 64
+
+# UDP ports of the first of several sensors, the next ones get the following pairs
+UDP_PORT_LIDAR = 7502
+UDP_PORT_IMU = 7503
+
+# Time given to every sensor worker to wind down (flush its pipelines) on exit
+SENSOR_STOP_TIMEOUT_S = 5.0
 
 G2MPSS = 9.80665
-DEG2RAD = 0.01745 # Hardvalue instead of pi/180. 
+DEG2RAD = 0.01745  # Hardvalue instead of pi/180.
+
+# foxglove.PackedElementField type of each point field dtype
+NUMERIC_TYPES = {
+    np.dtype(np.uint8): PackedElementField.NumericType.UINT8,
+    np.dtype(np.uint16): PackedElementField.NumericType.UINT16,
+    np.dtype(np.uint32): PackedElementField.NumericType.UINT32,
+    np.dtype(np.float32): PackedElementField.NumericType.FLOAT32,
+    np.dtype(np.float64): PackedElementField.NumericType.FLOAT64,
+}
+
 
 # We subclass client.Scans and provide our own iterator interface
 # This is necessary to extract both the LidarScans and the IMU packets from the same packet source
 class LidarPacketAndIMUPacketScans(client.Scans):
+    @classmethod
+    def stream(
+        cls,
+        hostname: str = "localhost",
+        lidar_port: int = 7502,
+        *,
+        imu_port: int = 7503,
+        buf_size: int = 640,
+        timeout: Optional[float] = 2.0,
+        complete: bool = True,
+        metadata: Optional[client.SensorInfo] = None,
+        fields=None,
+    ) -> "LidarPacketAndIMUPacketScans":
+        """As client.Scans.stream, but listening for IMU packets on ``imu_port``
+        rather than always 7503, so several sensors can stream to one host"""
+
+        source = Sensor(
+            hostname,
+            lidar_port,
+            imu_port,
+            metadata=metadata,
+            buf_size=buf_size,
+            timeout=timeout,
+            _flush_before_read=True,
+        )
+        return cls(
+            source, timeout=timeout, complete=complete, fields=fields, _max_latency=2
+        )
+
+    # Azimuth sectors handed out while a frame is being batched, see with_sectors
+    _sector_packets = 0
+    _on_sector: Optional[Callable[[LidarScan, int, int], None]] = None
+
+    def with_sectors(
+        self, sector_packets: int, on_sector: Callable[[LidarScan, int, int], None]
+    ) -> "LidarPacketAndIMUPacketScans":
+        """Also call ``on_sector(lidar_scan, start_column, stop_column)`` as soon as
+        the columns of an azimuth sector, ``sector_packets`` column packets starting
+        at column 0, have been batched into the scan being received. Partial and
+        incomplete frames included: the columns not received are left empty. The
+        remaining columns of the scan are written while the callback runs."""
+
+        self._sector_packets = sector_packets
+        self._on_sector = on_sector
+        return self
+
+    # Pool the scans are taken from, see with_scan_pool
+    _scan_pool: Optional[ScanPool] = None
+
+    def new_scan(self) -> LidarScan:
+        """A new, empty LidarScan of the sensor with the fields of this stream"""
+
+        fmt = self._source.metadata.format
+        return LidarScan(
+            fmt.pixels_per_column,
+            fmt.columns_per_frame,
+            self._fields,
+            fmt.columns_per_packet,
+        )
+
+    def with_scan_pool(self, scan_pool: ScanPool) -> "LidarPacketAndIMUPacketScans":
+        """Batch packets into scans of ``scan_pool`` instead of allocating a new
+        LidarScan per frame. A yielded scan (or one passed to the sector callback)
+        is recycled once the next item is requested, unless the consumer retained it
+        (and releases it when done)."""
+
+        self._scan_pool = scan_pool
+        return self
+
     def __iter__(
         self,
     ) -> Iterator[Tuple[Optional[Dict[str, np.ndarray]], Optional[LidarScan]]]:
@@ -63,9 +175,17 @@ class LidarPacketAndIMUPacketScans(client.Scans):
         )
 
         ls_write = None
+        scan_pool = self._scan_pool
         pf = _client.PacketFormat.from_info(self._source.metadata)
         batch = _client.ScanBatcher(w, pf)
 
+        # Columns [start, stop) of the sector being batched, if any, and whether they
+        # have been written (a packet completing a frame is only written with the
+        # next one)
+        sector_width = self._sector_packets * columns_per_packet
+        sector = None
+        sector_written = False
+
         # Time from which to measure timeout
         start_ts = time.monotonic()
 
@@ -78,8 +198,12 @@ class LidarPacketAndIMUPacketScans(client.Scans):
                 self._packets_consumed += 1
             except StopIteration:
                 if ls_write is not None:
+                    if sector is not None and sector_written:
+                        self._on_sector(ls_write, *sector)
                     if not self._complete or ls_write.complete(column_window):
                         yield None, ls_write
+                    if scan_pool is not None:
+                        scan_pool.release(ls_write)
                 return
             except ClientTimeout:
                 self._timed_out = True
@@ -92,14 +216,46 @@ class LidarPacketAndIMUPacketScans(client.Scans):
                 return
 
             if isinstance(packet, LidarPacket):
-                ls_write = ls_write or LidarScan(h, w, self._fields, columns_per_packet)
+                if ls_write is None:
+                    ls_write = (
+                        scan_pool.acquire()
+                        if scan_pool is not None
+                        else LidarScan(h, w, self._fields, columns_per_packet)
+                    )
 
-                if batch(packet, ls_write):
+                completed = batch(packet, ls_write)
+
+                if sector_width:
+                    first_column = int(packet.measurement_id[0])
+                    start = first_column - first_column % sector_width
+                    if completed:
+                        # The rest of the last sector of the frame is not coming
+                        if sector is not None and sector_written:
+                            self._on_sector(ls_write, *sector)
+                        sector, sector_written = None, False
+                    elif sector is not None and sector[0] != start:
+                        self._on_sector(ls_write, *sector)
+                        sector = None
+
+                    if sector is None:
+                        sector = (start, min(start + sector_width, w))
+                    sector_written = not completed
+
+                    if (
+                        sector_written
+                        and first_column + columns_per_packet >= sector[1]
+                    ):
+                        self._on_sector(ls_write, *sector)
+                        sector = None
+
+                if completed:
                     # Got a new frame, return it and start another
                     if not self._complete or ls_write.complete(column_window):
                         yield None, ls_write
                         self._scans_produced += 1
                         start_ts = time.monotonic()
+                    if scan_pool is not None:
+                        scan_pool.release(ls_write)
                     ls_write = None
 
                     # Drop data along frame boundaries to maintain _max_latency and
@@ -111,12 +267,17 @@ class LidarPacketAndIMUPacketScans(client.Scans):
                         if drop_frames > 0:
                             sensor.flush(drop_frames)
                             batch = _client.ScanBatcher(w, pf)
+                            sector = None
 
             elif isinstance(packet, ImuPacket):
                 yield {
                     "acceleration": packet.accel,
                     "angular_velocity": packet.angular_vel,
                     "capture_timestamp": packet.capture_timestamp,
+                    # Per timestamp_mode, on the clock of the column timestamps
+                    # (sys_ts is the time since the sensor booted)
+                    "accel_timestamp": packet.accel_ts,
+                    "gyro_timestamp": packet.gyro_ts,
                 }, None
 
 
@@ -131,54 +292,188 @@ def imu_data_to_imu_proto_payload(imu_data: dict, args):
     payload_acc.timestamp.FromNanoseconds(int(imu_data["capture_timestamp"] * 1e9))
     payload_ang.timestamp.FromNanoseconds(int(imu_data["capture_timestamp"] * 1e9))
 
-    payload_acc.vector.x = imu_data["acceleration"][0]*G2MPSS
-    payload_acc.vector.y = imu_data["acceleration"][1]*G2MPSS
-    payload_acc.vector.z = imu_data["acceleration"][2]*G2MPSS
+    payload_acc.vector.x = imu_data["acceleration"][0] * G2MPSS
+    payload_acc.vector.y = imu_data["acceleration"][1] * G2MPSS
+    payload_acc.vector.z = imu_data["acceleration"][2] * G2MPSS
 
-    payload_ang.vector.x = imu_data["angular_velocity"][0]*DEG2RAD
-    payload_ang.vector.y = imu_data["angular_velocity"][1]*DEG2RAD
-    payload_ang.vector.z = imu_data["angular_velocity"][2]*DEG2RAD
+    payload_ang.vector.x = imu_data["angular_velocity"][0] * DEG2RAD
+    payload_ang.vector.y = imu_data["angular_velocity"][1] * DEG2RAD
+    payload_ang.vector.z = imu_data["angular_velocity"][2] * DEG2RAD
 
     return payload_acc, payload_ang
 
 
-def lidarscan_to_points(lidar_scan: LidarScan, xyz_lut: client.XYZLut, info):
-    """Destagger an Ouster scan into an (N, 6) float64 array of
-    [x, y, z, signal, reflectivity, near_ir] points. Shared by the raw
-    (foxglove.PointCloud) and compressed (Draco) payload builders."""
+@functools.lru_cache(maxsize=None)
+def imu_template() -> MessageTemplate:
+    """The Decomposed3DVector payloads of the IMU samples, their vector written as
+    the data of the template"""
 
-    logging.debug("Processing lidar scan with timestamp: %s", lidar_scan)
+    return MessageTemplate(Decomposed3DVector(), data_field="vector")
+
+
+def imu_data_to_imu_envelopes(imu_data: dict) -> Tuple[bytes, bytes]:
+    """The enclosed acc/ang payloads of imu_data_to_imu_proto_payload, written from
+    imu_template with their timestamps encoded once, rather than built, serialized
+    and enclosed one by one"""
 
-    # Destagger data
-    xyz_destaggered = client.destagger(info, xyz_lut(lidar_scan))
-    signal = client.destagger(info, lidar_scan.field(client.ChanField.SIGNAL))
-    reflectivity = client.destagger(
-        info, lidar_scan.field(client.ChanField.REFLECTIVITY)
+    timestamp_ns = int(imu_data["capture_timestamp"] * 1e9)
+    acc_x, acc_y, acc_z = imu_data["acceleration"][:3]
+    ang_x, ang_y, ang_z = imu_data["angular_velocity"][:3]
+    acceleration = encode_vector3(acc_x * G2MPSS, acc_y * G2MPSS, acc_z * G2MPSS)
+    angular_velocity = encode_vector3(ang_x * DEG2RAD, ang_y * DEG2RAD, ang_z * DEG2RAD)
+
+    envelope_acc, envelope_ang = imu_template().enclose_all(
+        timestamp_ns, (acceleration, angular_velocity)
     )
-    near_ir = client.destagger(info, lidar_scan.field(client.ChanField.NEAR_IR))
+    return envelope_acc, envelope_ang
+
 
-    # Points as [[x, y, z, signal, reflectivity, near_ir], ...]
-    points = np.concatenate(
-        [
-            xyz_destaggered,
-            signal.reshape(list(signal.shape) + [1]),
-            reflectivity.reshape(list(reflectivity.shape) + [1]),
-            near_ir.reshape(list(near_ir.shape) + [1]),
-        ],
-        axis=-1,
+def sector_columns(metadata: client.SensorInfo, args) -> int:
+    """Columns per azimuth sector with --sector-packets, 0 when publishing whole frames"""
+
+    return min(
+        args.sector_packets * metadata.format.columns_per_packet,
+        metadata.format.columns_per_frame,
     )
 
-    points = points.reshape(-1, points.shape[-1])
-    logging.debug("Points shape: %s", points.shape)
+
+def sectors_per_frame(metadata: client.SensorInfo, args) -> int:
+    """Number of point cloud samples published per frame"""
+
+    columns = sector_columns(metadata, args)
+    return -(-metadata.format.columns_per_frame // columns) if columns else 1
+
+
+def make_sector_projector(
+    metadata: client.SensorInfo, args
+) -> Optional[SectorProjector]:
+    """Projector of the azimuth sectors of --sector-packets column packets, with the
+    point layout, channels and range filter from the command line, if enabled"""
+
+    columns = sector_columns(metadata, args)
+    if not columns:
+        return None
+
+    return SectorProjector(
+        metadata,
+        columns,
+        layout=args.point_layout,
+        drop_invalid=args.drop_invalid,
+        min_range_mm=round(args.min_range * 1000),
+        max_range_mm=None if args.max_range is None else round(args.max_range * 1000),
+        channels=point_channels(args),
+    )
+
+
+def scan_sector(
+    lidar_scan: LidarScan, start_column: int, stop_column: int, columns: int
+) -> Dict[str, int]:
+    """Bounds and sensor timestamps (ns) of the sector of ``columns`` columns
+    [start_column, stop_column) of a scan, as published with its point clouds"""
+
+    timestamps = lidar_scan.timestamp[start_column:stop_column]
+    received = timestamps[timestamps > 0]
+    return {
+        "frame_id": int(lidar_scan.frame_id),
+        "sector": start_column // columns,
+        "sectors": -(-lidar_scan.w // columns),
+        "start_column": start_column,
+        "stop_column": stop_column,
+        "start_timestamp": int(received.min()) if received.size else 0,
+        "end_timestamp": int(received.max()) if received.size else 0,
+    }
+
+
+def make_scan_pool(scans: LidarPacketAndIMUPacketScans, args) -> ScanPool:
+    """Pool of --scan-pool scans the stream batches its frames into. By default as
+    many as the pipeline can hold at once: its two queues, the scan in each stage,
+    the one being batched and the next one."""
+
+    size = args.scan_pool
+    if size is None:
+        size = 2 * getattr(args, "queue_size", 0) + 4
+    scan_pool = ScanPool(scans.new_scan, size, args.scan_pool_policy)
+    scans.with_scan_pool(scan_pool)
+    return scan_pool
+
+
+def point_channels(args) -> Tuple[str, ...]:
+    """Channels carried along with XYZ as selected with --fields, in point field
+    order"""
+
+    return tuple(name for name in POINT_CHANNELS if name in args.fields)
+
+
+def scan_fields(metadata: client.SensorInfo, args) -> Dict[client.ChanField, np.dtype]:
+    """Fields batched into the LidarScans, typed as in the lidar profile of the
+    sensor: RANGE, needed for XYZ, and the channels selected with --fields"""
+
+    fields = {client.ChanField.RANGE} | {
+        POINT_CHANNELS[name] for name in point_channels(args)
+    }
+    return {
+        field: dtype
+        for field, dtype in client.get_field_types(
+            metadata.format.udp_profile_lidar
+        ).items()
+        if field in fields
+    }
+
+
+def make_projector(metadata: client.SensorInfo, args) -> Projector:
+    """Projector of the sensor with the point layout, channels and range filter from
+    the command line (ranges given in meters, the sensor reports millimetres)."""
+
+    return Projector(
+        metadata,
+        args.point_layout,
+        drop_invalid=args.drop_invalid,
+        min_range_mm=round(args.min_range * 1000),
+        max_range_mm=None if args.max_range is None else round(args.max_range * 1000),
+        channels=point_channels(args),
+    )
+
+
+def lidarscan_to_points(lidar_scan: LidarScan, projector: Projector):
+    """Destagger an Ouster scan into a structured array of [x, y, z, signal,
+    reflectivity, near_ir] points, or the channels selected with --fields, laid out
+    as selected with --point-layout. Shared by the raw (foxglove.PointCloud) and
+    compressed (Draco) payload builders. The array is a buffer owned by the
+    projector, hand it back with projector.release when done. With
+    --drop-invalid/--min-range/--max-range only the points within range are kept."""
+
+    logging.debug("Processing lidar scan with timestamp: %s", lidar_scan)
+
+    points = projector.project(lidar_scan)
+
+    logging.debug(
+        "Projected scan: kept=%s dropped=%s points",
+        projector.last_kept,
+        projector.last_dropped,
+    )
     return points
 
 
-def points_to_pointcloud_proto_payload(points: np.ndarray, lidar_scan: LidarScan, frame_id):
-    """Build an uncompressed foxglove.PointCloud (float64 fields) from an (N, 6) points array."""
+def points_to_pointcloud_proto_payload(
+    points: np.ndarray,
+    lidar_scan: LidarScan,
+    frame_id,
+    timestamp_ns: Optional[int] = None,
+    raw_codec: Optional[RawCodec] = None,
+    with_data: bool = True,
+):
+    """Build an uncompressed foxglove.PointCloud from a structured points array. The
+    fields, their offsets and the point stride follow the dtype of the array, so the
+    payload data is the array memory as is, or compressed losslessly by
+    ``raw_codec`` (see points_to_pointcloud_data). Stamped with ``timestamp_ns``, the
+    first column of the scan by default. Without ``with_data`` the data is left
+    unset, for the caller to append."""
 
     payload = PointCloud()
 
-    payload.timestamp.FromNanoseconds(int(lidar_scan.timestamp[0]))
+    if timestamp_ns is None:
+        timestamp_ns = int(lidar_scan.timestamp[0])
+    payload.timestamp.FromNanoseconds(timestamp_ns)
     if frame_id is not None:
         payload.frame_id = frame_id
 
@@ -186,57 +481,603 @@ def points_to_pointcloud_proto_payload(points: np.ndarray, lidar_scan: LidarScan
     payload.pose.orientation.w = 1
 
     # Fields
-    payload.fields.add(name="x", offset=0, type=PackedElementField.NumericType.FLOAT64)
-    payload.fields.add(name="y", offset=8, type=PackedElementField.NumericType.FLOAT64)
-    payload.fields.add(name="z", offset=16, type=PackedElementField.NumericType.FLOAT64)
+    for name in points.dtype.names:
+        field_type, offset = points.dtype.fields[name][:2]
+        payload.fields.add(name=name, offset=offset, type=NUMERIC_TYPES[field_type])
 
-    payload.fields.add(
-        name="signal", offset=24, type=PackedElementField.NumericType.FLOAT64
-    )
-    payload.fields.add(
-        name="reflectivity", offset=32, type=PackedElementField.NumericType.FLOAT64
-    )
-    payload.fields.add(
-        name="near_ir", offset=40, type=PackedElementField.NumericType.FLOAT64
+    payload.point_stride = points.dtype.itemsize
+    if with_data:
+        payload.data = bytes(points_to_pointcloud_data(points, raw_codec))
+
+    return payload
+
+
+def points_to_pointcloud_data(
+    points: np.ndarray, raw_codec: Optional[RawCodec] = None
+) -> Union[bytes, memoryview]:
+    """The foxglove.PointCloud data of a structured points array: a view of the array
+    memory, not a copy, or its lossless compression by ``raw_codec`` if given"""
+
+    if raw_codec is not None:
+        return raw_codec.encode(points)
+    return memoryview(np.ascontiguousarray(points).view(np.uint8))
+
+
+@functools.lru_cache(maxsize=None)
+def pointcloud_template(dtype: np.dtype, frame_id) -> MessageTemplate:
+    """The foxglove.PointCloud payloads of points of ``dtype``, with their fields,
+    pose and frame id serialized once"""
+
+    return MessageTemplate(
+        points_to_pointcloud_proto_payload(
+            np.empty(0, dtype), None, frame_id, 0, with_data=False
+        )
     )
 
-    data = points.tobytes()
-    payload.point_stride = len(data) // len(points)
-    payload.data = data
 
-    return payload
+@functools.lru_cache(maxsize=None)
+def compressed_pointcloud_template(frame_id) -> MessageTemplate:
+    """The foxglove.CompressedPointCloud payloads, with their format, pose and frame
+    id serialized once"""
+
+    return MessageTemplate(draco_to_compressed_proto_payload(b"", None, frame_id, 0))
+
+
+def make_raw_codec(args) -> Optional[RawCodec]:
+    """Lossless codec of the raw point cloud topic as selected with --raw-codec, if
+    any"""
+
+    if args.raw_codec == "none":
+        return None
+
+    return RawCodec(args.raw_codec, args.raw_codec_level, not args.no_raw_shuffle)
+
+
+def point_cloud_source_id(args) -> str:
+    """Source id of the raw point cloud topic. With a --raw-codec its data is no
+    plain point data, so it is published under <source-id>/<codec name> (see
+    RawCodec.name) for consumers to tell from the key alone."""
+
+    raw_codec = make_raw_codec(args)
+    if raw_codec is None:
+        return args.source_id
+    return f"{args.source_id}/{raw_codec.name}"
+
+
+def reduce_points(points: np.ndarray, decimate: int, args) -> np.ndarray:
+    """Thin out a structured points array for browser-friendly bandwidth, as selected
+    with --reduction: keep every Nth point in memory order (stride), or one point per
+    occupied voxel (voxel) of --voxel-size meters, scaled by the decimation."""
 
+    if args.reduction == "voxel":
+        return voxel_downsample(points, args.voxel_size * decimate, args.voxel_mode)
+    return points[:: max(1, decimate)]
 
-def points_to_compressed_proto_payload(points: np.ndarray, lidar_scan: LidarScan, args):
-    """Build a Draco-compressed foxglove.CompressedPointCloud from an (N, 6) points array,
-    decimating to every Nth point for browser-friendly bandwidth. POSITION is encoded as
-    3-component float32; signal/reflectivity/near_ir ride along as named generic attributes
-    (string keys so Foxglove recovers the field names)."""
 
-    decimate = max(1, args.decimate)
-    pts = points[::decimate]
+def reduce_points_levels(
+    points: np.ndarray, decimates: Tuple[int, ...], args
+) -> Dict[int, np.ndarray]:
+    """reduce_points at each of the ``decimates``, by decimation. Voxel levels share
+    the binning and sorting of the points (see voxel_downsample_levels)."""
+
+    if args.reduction == "voxel":
+        return voxel_downsample_levels(
+            points, args.voxel_size, decimates, args.voxel_mode
+        )
+    return {decimate: points[:: max(1, decimate)] for decimate in decimates}
+
+
+def points_to_draco_arrays(points: np.ndarray):
+    """Split a structured points array into the float32 inputs of the Draco encoder: a
+    3-component POSITION array and the channels of the points (signal/reflectivity/
+    near_ir) as named generic attributes (string keys so Foxglove recovers the field
+    names)."""
+
+    xyz = np.empty((len(points), 3), np.float32)
+    for axis, name in enumerate(("x", "y", "z")):
+        xyz[:, axis] = points[name]
+
+    generic_attributes = {
+        name: points[name].astype(np.float32).reshape(-1, 1)
+        for name in points.dtype.names[3:]
+    }
+
+    return xyz, generic_attributes
+
+
+def draco_to_compressed_proto_payload(
+    data: bytes,
+    lidar_scan: Optional[LidarScan],
+    frame_id,
+    timestamp_ns: Optional[int] = None,
+):
+    """Wrap a Draco-encoded point cloud into a foxglove.CompressedPointCloud, stamped
+    with ``timestamp_ns``, the first column of the scan by default (the scan may be
+    None when ``timestamp_ns`` is given)."""
 
     payload = CompressedPointCloud()
-    payload.timestamp.FromNanoseconds(int(lidar_scan.timestamp[0]))
-    if args.frame_id is not None:
-        payload.frame_id = args.frame_id
+    if timestamp_ns is None:
+        timestamp_ns = int(lidar_scan.timestamp[0])
+    payload.timestamp.FromNanoseconds(timestamp_ns)
+    if frame_id is not None:
+        payload.frame_id = frame_id
     payload.pose.orientation.w = 1  # identity pose (sensor-relative)
     payload.format = "draco"
-    payload.data = DracoPy.encode(
-        pts[:, :3].astype(np.float32),
-        quantization_bits=14,
-        compression_level=7,
-        preserve_order=True,
-        generic_attributes={
-            "signal": pts[:, 3].astype(np.float32).reshape(-1, 1),
-            "reflectivity": pts[:, 4].astype(np.float32).reshape(-1, 1),
-            "near_ir": pts[:, 5].astype(np.float32).reshape(-1, 1),
-        },
+    payload.data = data
+
+    return payload
+
+
+def compression_settings(args) -> CompressionSettings:
+    """The (initial) compressed topic settings given on the command line"""
+
+    return CompressionSettings(
+        decimate=max(1, args.decimate),
+        quantization_bits=args.quantization_bits,
+        compression_level=args.compression_level,
+    )
+
+
+def make_compression_controller(
+    metadata: client.SensorInfo, args
+) -> Optional[CompressionController]:
+    """Controller adapting the compression settings to the frame period of the lidar
+    mode and the target bitrate, if --adaptive-compression is enabled. With an encode
+    pool, frames are encoded in parallel so each has that many frame periods. With
+    --sector-packets every sector is a frame of its own."""
+
+    if not args.adaptive_compression:
+        return None
+
+    frame_rate = metadata.format.fps * sectors_per_frame(metadata, args)
+    return CompressionController(
+        compression_settings(args),
+        encode_budget_s=args.encode_budget / frame_rate * max(1, args.encode_workers),
+        frame_rate=frame_rate,
+        target_bitrate_bps=(
+            None if args.target_bitrate is None else args.target_bitrate * 1e6
+        ),
+        max_decimate=args.max_decimate,
+        min_quantization_bits=args.min_quantization_bits,
     )
 
+
+def points_to_compressed_proto_payload(
+    points: np.ndarray,
+    lidar_scan: LidarScan,
+    args,
+    settings: Optional[CompressionSettings] = None,
+):
+    """Build a Draco-compressed foxglove.CompressedPointCloud from a structured points
+    array, encoding inline on the calling thread with the given settings (the ones
+    from the command line by default)."""
+
+    settings = settings or compression_settings(args)
+    xyz, generic_attributes = points_to_draco_arrays(
+        reduce_points(points, settings.decimate, args)
+    )
+    data = draco_encode(
+        xyz, generic_attributes, settings.quantization_bits, settings.compression_level
+    )
+
+    return draco_to_compressed_proto_payload(data, lidar_scan, args.frame_id)
+
+
+def make_range_image_encoder(
+    metadata: client.SensorInfo, args
+) -> Optional[RangeImageEncoder]:
+    """Range image encoder of the sensor, if --range-image is enabled"""
+
+    if not args.range_image:
+        return None
+
+    return RangeImageEncoder(
+        metadata,
+        range_resolution_mm=args.range_image_resolution,
+        level=args.range_image_level,
+        channels=args.fields,
+    )
+
+
+def range_image_to_compressed_image_proto_payload(
+    data: bytes, lidar_scan: LidarScan, frame_id
+):
+    """Wrap a PNG-encoded channel image into a foxglove.CompressedImage."""
+
+    payload = CompressedImage()
+    payload.timestamp.FromNanoseconds(int(lidar_scan.timestamp[0]))
+    if frame_id is not None:
+        payload.frame_id = frame_id
+    payload.format = "png"
+    payload.data = data
+
     return payload
 
 
+def start_range_image_transport(
+    session: zenoh.Session, args, encoder: RangeImageEncoder
+) -> Tuple[Dict[str, zenoh.Publisher], zenoh.Queryable]:
+    """Declare one image publisher per channel ({source_id}/{channel}) and publish the
+    metadata/LUT message receivers need to rebuild XYZ, once on startup and on request
+    to late joiners through a queryable on the same key. Undeclare the queryable once
+    done, its callback keeps the process from exiting."""
+
+    publishers = {}
+    for channel in encoder.channels:
+        key = keelson.construct_pubsub_key(
+            base_path=args.realm,
+            entity_id=args.entity_id,
+            subject=KEELSON_SUBJECT_IMAGE_COMPRESSED,
+            source_id=f"{args.source_id}/{channel}",
+        )
+        logging.info("Range image key: %s", key)
+        publishers[channel] = session.declare_publisher(
+            key,
+            priority=zenoh.Priority.INTERACTIVE_HIGH,
+            congestion_control=zenoh.CongestionControl.DROP,
+        )
+
+    metadata_key = keelson.construct_pubsub_key(
+        base_path=args.realm,
+        entity_id=args.entity_id,
+        subject=KEELSON_SUBJECT_CONFIGURATION,
+        source_id=f"{args.source_id}/range_image",
+    )
+    logging.info("Range image metadata key: %s", metadata_key)
+
+    payload = TimestampedString()
+    payload.timestamp.FromNanoseconds(time.time_ns())
+    payload.value = json.dumps(encoder.metadata(), separators=(",", ":"))
+    envelope = keelson.enclose(payload.SerializeToString())
+
+    def _on_query(query: zenoh.Query):
+        query.reply(metadata_key, envelope)
+
+    queryable = session.declare_queryable(metadata_key, _on_query)
+    session.put(metadata_key, envelope)
+
+    return publishers, queryable
+
+
+def publish_imu(
+    imu_data: dict,
+    imu_publisher_acc,
+    imu_publisher_ang,
+    args,
+    metrics: Metrics,
+    ingested_at: float,
+):
+    """Enclose and publish one IMU sample, read from the packet source at
+    ``ingested_at`` (time.monotonic), on the acc/ang keys. The envelopes are
+    written from a cached template (see imu_data_to_imu_envelopes)."""
+
+    with metrics.timed("imu"):
+        envelope_acc, envelope_ang = imu_data_to_imu_envelopes(imu_data)
+
+        imu_publisher_acc.put(envelope_acc)
+        imu_publisher_ang.put(envelope_ang)
+
+    latency = time.monotonic() - ingested_at
+    metrics.observe("imu_ingest_to_put", latency)
+    if latency > args.imu_latency_budget / 1e3:
+        metrics.count("imu_late")
+
+    logging.debug("...published IMU to zenoh!")
+
+
+def start_imu_path(
+    imu_publisher_acc, imu_publisher_ang, args, metrics: Metrics
+) -> Pipeline:
+    """Start the thread publishing IMU samples. Put (imu_data, time.monotonic())
+    items into the returned pipeline. IMU samples have their own small queue and
+    thread, so they never wait behind the projection, encoding or publishing of a
+    lidar frame."""
+
+    imu_pipeline = Pipeline(IMU_QUEUE_SIZE, "drop-oldest")
+    imu_pipeline.add_stage(
+        "imu",
+        lambda item: publish_imu(
+            item[0], imu_publisher_acc, imu_publisher_ang, args, metrics, item[1]
+        ),
+    )
+    imu_pipeline.start()
+    return imu_pipeline
+
+
+def observe_put_latency(
+    metrics: Metrics,
+    topic: str,
+    lidar_scan: Optional[LidarScan],
+    ingested_at: float,
+    sensor_timestamp_ns: Optional[int] = None,
+):
+    """Record the latency of a put of a scan, from the moment the scan was complete
+    (time.monotonic) and, when the sensor clock is synchronized with ours, from the
+    sensor timestamp of its last column (or ``sensor_timestamp_ns``, in which case
+    the scan may be None)."""
+
+    metrics.observe(f"{topic}_ingest_to_put", time.monotonic() - ingested_at)
+    if metrics.sensor_clock_synced:
+        if sensor_timestamp_ns is None:
+            sensor_timestamp_ns = int(lidar_scan.timestamp.max())
+        metrics.observe(
+            f"{topic}_sensor_to_put", (time.time_ns() - sensor_timestamp_ns) / 1e9
+        )
+
+
+def publish_range_images(
+    lidar_scan: LidarScan,
+    encoder: RangeImageEncoder,
+    range_image_publishers: Dict[str, zenoh.Publisher],
+    args,
+    metrics: Metrics,
+    ingested_at: float,
+):
+    """Encode and publish the channel images of one scan, completed at
+    ``ingested_at`` (time.monotonic)."""
+
+    with metrics.timed("range_image"):
+        images = encoder.encode(lidar_scan)
+
+    with metrics.timed("range_image_put"):
+        for channel, data in images.items():
+            payload = range_image_to_compressed_image_proto_payload(
+                data, lidar_scan, args.frame_id
+            )
+            range_image_publishers[channel].put(enclose(payload.SerializeToString()))
+    observe_put_latency(metrics, "range_image", lidar_scan, ingested_at)
+    logging.debug("...published range images to zenoh!")
+
+
+def publish_points(
+    points: np.ndarray,
+    lidar_scan: LidarScan,
+    point_cloud_publisher,
+    point_cloud_compressed_publisher,
+    args,
+    metrics: Metrics,
+    ingested_at: float,
+    encode_pool: Optional[EncodePool] = None,
+    controller: Optional[CompressionController] = None,
+    sector: Optional[Dict[str, int]] = None,
+    raw_codec: Optional[RawCodec] = None,
+):
+    """Build, enclose and publish the raw and/or compressed point cloud payloads of
+    one projected scan, completed at ``ingested_at`` (time.monotonic). A publisher
+    that is None is skipped. With a raw codec the raw payload data is compressed
+    losslessly and how is attached as JSON under "encoding". The envelopes are
+    written from cached templates (see pointcloud_template), copying the point data
+    once. A ShmPublisher gets the raw envelope in parts, assembled in its
+    shared-memory buffer. With an encode pool the Draco encode runs on the pool and
+    the compressed payload is published, in frame order, once it is done. The
+    compression settings come from the controller, if any, and are attached to the
+    compressed sample as JSON.
+
+    The compressed publisher may be a dict of publishers by level of detail (see
+    declare_compressed_publishers): every level is published, decimated that many
+    times more than the settings say, with its level attached under "lod".
+
+    For the points of an azimuth sector (see scan_sector) the payloads are stamped
+    with the first column of the sector and the sector is attached as JSON under
+    "sector" to both samples."""
+
+    # Read from the scan up front, the scan may be recycled while the compressed
+    # payload is still being encoded
+    if sector is not None:
+        timestamp_ns = sector["start_timestamp"]
+        sensor_timestamp_ns = sector["end_timestamp"]
+    else:
+        timestamp_ns = int(lidar_scan.timestamp[0])
+        sensor_timestamp_ns = int(lidar_scan.timestamp.max())
+
+    if point_cloud_publisher is not None:
+        with metrics.timed("raw_payload"):
+            template = pointcloud_template(points.dtype, args.frame_id)
+            data = points_to_pointcloud_data(points, raw_codec)
+            if isinstance(point_cloud_publisher, ShmPublisher):
+                # Copied once, into the shared buffer
+                envelope = template.enclosed_parts(timestamp_ns, data)
+            else:
+                envelope = template.enclose(timestamp_ns, data)
+        raw_attachment = {}
+        if raw_codec is not None:
+            raw_attachment["encoding"] = raw_codec.description(points)
+            metrics.gauge("raw_ratio", round(points.nbytes / max(1, len(data)), 2))
+        if sector is not None:
+            raw_attachment["sector"] = sector
+        with metrics.timed("raw_put"):
+            put = point_cloud_publisher.put(
+                envelope,
+                attachment=(
+                    json.dumps(raw_attachment).encode() if raw_attachment else None
+                ),
+            )
+        if put is False:
+            # A ShmPublisher without room in its pool
+            metrics.count("shm_fallback")
+        observe_put_latency(
+            metrics, "raw", lidar_scan, ingested_at, sensor_timestamp_ns
+        )
+        logging.debug("...published LIDAR to zenoh!")
+
+    if point_cloud_compressed_publisher is None:
+        return
+
+    if len(points) == 0:
+        # Nothing within range, the Draco encoder rejects empty point clouds
+        logging.debug("No points left to compress, skipping compressed payload")
+        return
+
+    # Without --lod the compressed topic is a single level, of decimation 1
+    lod = isinstance(point_cloud_compressed_publisher, dict)
+    levels = (
+        point_cloud_compressed_publisher
+        if lod
+        else {1: point_cloud_compressed_publisher}
+    )
+    # The controller follows the densest level, the decimation of every level is
+    # relative to its settings
+    densest = min(levels)
+
+    settings = (
+        controller.settings if controller is not None else compression_settings(args)
+    )
+
+    def _on_encoded(level: int, attachment: bytes, result: Tuple[bytes, float]):
+        data, encode_s = result
+        metrics.observe("encode", encode_s)
+        if level == densest:
+            metrics.gauge("compression", asdict(settings))
+            if controller is not None:
+                controller.update(encode_s, len(data))
+
+        envelope = compressed_pointcloud_template(args.frame_id).enclose(
+            timestamp_ns, data
+        )
+        with metrics.timed("compressed_put"):
+            put = levels[level].put(envelope, attachment=attachment)
+        if put is False:
+            metrics.count("shm_fallback")
+        observe_put_latency(
+            metrics, "compressed", None, ingested_at, sensor_timestamp_ns
+        )
+        logging.debug(
+            "...published compressed LIDAR to zenoh! (%s, lod %d)", settings, level
+        )
+
+    # All levels are reduced from the one projection, sharing the voxel binning
+    reduced = reduce_points_levels(
+        points, tuple(settings.decimate * level for level in levels), args
+    )
+
+    for level in levels:
+        # Reported with every frame, the settings may change from frame to frame
+        attachment = asdict(settings)
+        if lod:
+            attachment["lod"] = level
+        if sector is not None:
+            attachment["sector"] = sector
+
+        xyz, generic_attributes = points_to_draco_arrays(
+            reduced[settings.decimate * level]
+        )
+        encode_args = (
+            xyz,
+            generic_attributes,
+            settings.quantization_bits,
+            settings.compression_level,
+        )
+        on_encoded = functools.partial(
+            _on_encoded, level, json.dumps(attachment).encode()
+        )
+
+        if encode_pool is None:
+            on_encoded(timed_draco_encode(*encode_args))
+        else:
+            # Levels are streams of their own, a sparse level never waits for the
+            # encode of a denser one
+            encode_pool.submit(
+                on_encoded,
+                timed_draco_encode,
+                *encode_args,
+                stream=(args.source_id, level),
+            )
+
+
+def declare_compressed_publishers(session: zenoh.Session, args):
+    """Publisher of the compressed point cloud topic or, with --lod, the publishers
+    of its levels of detail by decimation, under <source-id>/lod<decimation>"""
+
+    def _declare(source_id: str):
+        key = keelson.construct_pubsub_key(
+            base_path=args.realm,
+            entity_id=args.entity_id,
+            subject=KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED,
+            source_id=source_id,
+        )
+        logging.info("PUB key: %s (decimate=%s)", key, args.decimate)
+        return session.declare_publisher(
+            key,
+            priority=zenoh.Priority.INTERACTIVE_HIGH,
+            congestion_control=zenoh.CongestionControl.DROP,
+        )
+
+    if not args.lod:
+        return _declare(args.source_id)
+    return {level: _declare(f"{args.source_id}/lod{level}") for level in args.lod}
+
+
+def share_memory(args, *publishers):
+    """The given publishers (or levels of detail of one, see
+    declare_compressed_publishers), those that are not None wrapped in ShmPublishers
+    sharing one pool of --shm-size MiB if --shm is enabled"""
+
+    if not args.shm:
+        return publishers
+
+    provider = make_shm_provider(args.shm_size * 2**20)
+    logging.info("Publishing point clouds through %d MiB shared memory", args.shm_size)
+
+    def _share(publisher):
+        if isinstance(publisher, dict):
+            return {level: _share(each) for level, each in publisher.items()}
+        return None if publisher is None else ShmPublisher(publisher, provider)
+
+    return tuple(_share(publisher) for publisher in publishers)
+
+
+def report_metrics(
+    metrics: Metrics,
+    metrics_publisher,
+    scans: LidarPacketAndIMUPacketScans,
+    encode_pool: EncodePool,
+    projector: Union[Projector, SectorProjector],
+    imu_pipeline: Pipeline,
+    pipeline: Optional[Pipeline] = None,
+):
+    """Log the stage timings and counters collected since the previous report,
+    together with ingestion, queue and encode counters, and publish them as one
+    compact JSON message."""
+
+    report = metrics.snapshot()
+
+    sensor = getattr(scans, "_source", None)
+    stages = pipeline.stats() if pipeline is not None else []
+    imu_stages = imu_pipeline.stats()
+    report["counters"].update(
+        packets_consumed=getattr(scans, "_packets_consumed", 0),
+        scans_produced=getattr(scans, "_scans_produced", 0),
+        frames_dropped=sum(stats["dropped"] for stats in stages),
+        imu_dropped=sum(stats["dropped"] for stats in imu_stages),
+        points_kept=projector.kept,
+        points_dropped=projector.dropped,
+        encode_pending=encode_pool.pending,
+        encode_failed=encode_pool.failed,
+    )
+    if isinstance(sensor, (Sensor, UdpPacketSource)):
+        report["counters"]["sensor_buffer_use"] = sensor.buf_use
+    if isinstance(sensor, UdpPacketSource):
+        report["counters"].update(sensor.stats())
+    scan_pool = getattr(scans, "_scan_pool", None)
+    if scan_pool is not None:
+        report["counters"].update(scan_pool.stats())
+    report["stages"] = stages + imu_stages
+
+    logging.info(
+        "Metrics: %s | %s",
+        " ".join(f"{name}={value}" for name, value in report["counters"].items()),
+        " ".join(
+            f"{name}={stats['mean']}/{stats['p99']}ms"
+            for name, stats in report["timings_ms"].items()
+        ),
+    )
+
+    payload = TimestampedString()
+    payload.timestamp.FromNanoseconds(time.time_ns())
+    payload.value = json.dumps(report, separators=(",", ":"))
+    metrics_publisher.put(keelson.enclose(payload.SerializeToString()))
+
+
 def sensor_config(query: zenoh.Queryable):
 
     print(
@@ -247,35 +1088,340 @@ def sensor_config(query: zenoh.Queryable):
     query.reply(zenoh.Sample("key", b"response"))
 
 
+def sensor_sources(args: argparse.Namespace) -> List[Tuple[str, str]]:
+    """(hostname, source id) of every --ouster-hostname HOSTNAME[=SOURCE_ID]. Without a
+    source id a single sensor publishes under --source-id, several sensors under
+    --source-id/<index>."""
+
+    sources = []
+    for index, sensor in enumerate(args.ouster_hostname):
+        hostname, _, source_id = sensor.partition("=")
+        if not source_id:
+            source_id = (
+                args.source_id
+                if len(args.ouster_hostname) == 1
+                else f"{args.source_id}/{index}"
+            )
+        sources.append((hostname, source_id))
+
+    if len({source_id for _, source_id in sources}) < len(sources):
+        raise ValueError(f"Sensors must publish under different source ids: {sources}")
+    return sources
+
+
+def split_cores(workers: int) -> List[Set[int]]:
+    """Split the cores this process may run on into ``workers`` disjoint sets (of at
+    least one core, shared round-robin when there are fewer cores than workers)"""
+
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) <= workers:
+        return [{cores[index % len(cores)]} for index in range(workers)]
+    return [set(part) for part in np.array_split(cores, workers)]
+
+
+def udp_destination(hostname: str) -> str:
+    """Address of this host on the route to the sensor, where it should stream to"""
+
+    # Connecting a UDP socket only looks up the route, nothing is sent
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.connect((hostname, UDP_PORT_LIDAR))
+        return probe.getsockname()[0]
+
+
+def fetch_metadata(hostname: str) -> client.SensorInfo:
+    """Sensor metadata read from the HTTP API of the sensor"""
+
+    # The connection also binds UDP ports, ephemeral ones as they are not read from
+    connection = SensorConnection(hostname, 0, 0)
+    try:
+        metadata = connection.get_metadata(legacy=False, timeout_sec=45)
+    finally:
+        connection.shutdown()
+    if not metadata:
+        raise client.ClientError(f"Failed to collect metadata from {hostname}")
+    return client.SensorInfo(metadata)
+
+
+def make_udp_source(
+    metadata: client.SensorInfo,
+    args,
+    lidar_port: int,
+    imu_port: int,
+    timeout: Optional[float] = 2.0,
+) -> UdpPacketSource:
+    """Native UDP packet source with the socket buffer and ring sizes from the command
+    line"""
+
+    return UdpPacketSource(
+        metadata,
+        lidar_port,
+        imu_port,
+        host=args.udp_host,
+        recv_buffer_bytes=round(args.udp_recv_buffer * 2**20),
+        ring_packets=args.udp_ring_packets,
+        timeout=timeout,
+    )
+
+
+def sensor_metadata(args, config: client.SensorConfig) -> client.SensorInfo:
+    """Metadata of the sensor in its active ``config``, from the sensor cache unless
+    --no-sensor-cache is given"""
+
+    if args.no_sensor_cache:
+        return fetch_metadata(args.ouster_hostname)
+    return SensorCache(args.sensor_cache).metadata(
+        args.ouster_hostname, config, fetch_metadata
+    )
+
+
+def open_sensor_stream(
+    args, config: client.SensorConfig, metadata: client.SensorInfo
+) -> LidarPacketAndIMUPacketScans:
+    """Scan stream of the configured sensor, batching the --fields channels, received
+    by the ouster-sdk client or, with --udp-source native, by UdpPacketSource"""
+
+    fields = scan_fields(metadata, args)
+
+    if args.udp_source == "native":
+        source = make_udp_source(
+            metadata, args, config.udp_port_lidar, config.udp_port_imu
+        )
+        return LidarPacketAndIMUPacketScans(source, complete=True, fields=fields)
+
+    return LidarPacketAndIMUPacketScans.stream(
+        args.ouster_hostname,
+        config.udp_port_lidar,
+        imu_port=config.udp_port_imu,
+        complete=True,
+        metadata=metadata,
+        fields=fields,
+    )
+
+
+def from_udp(session: zenoh.Session, args: argparse.Namespace):
+    """Publish the scans of a sensor, described by --metadata-file, that streams to
+    this host but is configured elsewhere, or of a UDP replay (replay.py)"""
+
+    with open(args.metadata_file, "r") as f:
+        metadata = client.SensorInfo(f.read())
+        logging.info("Read metadata from %s", args.metadata_file)
+
+    source = make_udp_source(metadata, args, args.lidar_port, args.imu_port, None)
+    logging.info("Listening on UDP ports %s/%s", source.lidar_port, source.imu_port)
+
+    encode_pool = EncodePool(args.encode_workers, args.encode_backend)
+    try:
+        with closing(
+            LidarPacketAndIMUPacketScans(
+                source,
+                complete=True,
+                timeout=None,
+                fields=scan_fields(metadata, args),
+            )
+        ) as stream:
+            publish_scans(
+                session,
+                args,
+                stream,
+                encode_pool,
+                threading.Event(),
+                sensor_clock_synced=metadata.config.timestamp_mode
+                != client.TimestampMode.TIME_FROM_INTERNAL_OSC,
+            )
+    finally:
+        encode_pool.close()
+
+
 def from_sensor(session: zenoh.Session, args: argparse.Namespace):
+    """Run every sensor given with --ouster-hostname on a worker thread of its own,
+    sharing the zenoh session and the encode pool. With --pin-cores each worker, and
+    the pipeline threads it starts, is restricted to its own set of cores. Several
+    sensors are configured to stream to this host, on UDP ports of their own."""
+
+    sources = sensor_sources(args)
+    core_sets = split_cores(len(sources)) if args.pin_cores else [None] * len(sources)
+
+    sensor_args = [
+        argparse.Namespace(
+            **{
+                **vars(args),
+                "ouster_hostname": hostname,
+                "source_id": source_id,
+                "udp_port_lidar": (
+                    UDP_PORT_LIDAR + 2 * index if len(sources) > 1 else None
+                ),
+                "udp_port_imu": UDP_PORT_IMU + 2 * index if len(sources) > 1 else None,
+            }
+        )
+        for index, (hostname, source_id) in enumerate(sources)
+    ]
+
+    encode_pool = EncodePool(args.encode_workers, args.encode_backend)
+    stop = threading.Event()
+    failed: List[str] = []
+
+    def _worker(worker_args: argparse.Namespace, cores: Optional[Set[int]]):
+        if cores is not None:
+            # Linux: pid 0 is the calling thread, threads started later inherit it
+            os.sched_setaffinity(0, cores)
+            logging.info(
+                "Sensor %s pinned to cores %s",
+                worker_args.ouster_hostname,
+                sorted(cores),
+            )
+        try:
+            run_sensor(session, worker_args, encode_pool, stop)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # The other sensors keep running
+            logging.exception("Sensor %s failed", worker_args.ouster_hostname)
+            failed.append(worker_args.ouster_hostname)
+
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(worker_args, cores),
+            name=f"sensor-{worker_args.source_id}",
+            daemon=True,
+        )
+        for worker_args, cores in zip(sensor_args, core_sets)
+    ]
+
+    try:
+        for worker in workers:
+            worker.start()
+        # Joined with a timeout so Ctrl-C reaches this thread
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(0.5)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(SENSOR_STOP_TIMEOUT_S)
+        encode_pool.close()
+
+    if failed:
+        raise RuntimeError(f"Sensor(s) failed: {', '.join(failed)}")
+
+
+def run_sensor(
+    session: zenoh.Session,
+    args: argparse.Namespace,
+    encode_pool: EncodePool,
+    stop: threading.Event,
+):
+    """Configure one sensor (--ouster-hostname) and publish its scans and IMU samples
+    under --source-id until ``stop`` is set. The encode pool may be shared with other
+    sensors."""
+
+    logging.info("Apply configuration...")
+    apply_config = client.SensorConfig()
+    apply_config.azimuth_window = (
+        args.view_angle_deg_start * 1000,
+        args.view_angle_deg_end * 1000,
+    )
+    apply_config.lidar_mode = client.LidarMode.from_string(args.lidar_mode)
+    if args.udp_port_lidar is not None:
+        # Streaming to this host, whatever destination the sensor had before
+        apply_config.udp_dest = udp_destination(args.ouster_hostname)
+        apply_config.udp_port_lidar = args.udp_port_lidar
+        apply_config.udp_port_imu = args.udp_port_imu
+    apply_config.operating_mode = client.OperatingMode.from_string(
+        "NORMAL"
+    )  # Always set to normal mode to start up the lidar
+
+    # Reconfigured (and the configuration persisted) only when it changes, which
+    # spares the restart of the sensor and the wear of its flash
+    config = client.get_config(args.ouster_hostname)
+    changes = config_changes(apply_config, config)
+    if changes:
+        logging.info("Reconfiguring %s: %s", args.ouster_hostname, changes)
+        client.set_config(args.ouster_hostname, apply_config, persist=True)
+        config = client.get_config(args.ouster_hostname)
+    else:
+        logging.info("%s is configured already", args.ouster_hostname)
+
+    logging.info("Connecting to Ouster sensor...")
+
+    logging.info(f"Sensor configuration:{config}")
+
+    ingress_timestamp = time.time_ns()
+    # payload = ConfigurationSensorPerception()
+    # ConfigurationSensorPerception.SensorType.Value("LIDAR")
+    # if str(config.operating_mode.name) == "NORMAL":
+    #     ConfigurationSensorPerception.mode_operating.Value("RUNNING")
+    # else:
+    #     ConfigurationSensorPerception.mode_operating.Value(config.operating_mode.name)
+    # payload.mode = config.lidar_mode.name
+    # payload.timestamp.FromNanoseconds(ingress_timestamp)
+    # payload.other_json = json.dumps(str(config))
+
+    # horizontal = (config.azimuth_window[1] - config.azimuth_window[0]) / 1000
+    # payload.view_horizontal_angel_deg = horizontal
+    # payload.view_horizontal_start_angel_deg = config.azimuth_window[0]
+    # payload.view_horizontal_end_angel_deg = config.azimuth_window[1]
+
+    # logging.info("Sensor configuration: \n %s", payload)
+    # serialized_payload = payload.SerializeToString()
+    # envelope = keelson.enclose(serialized_payload)
+    # publisher_config.put(envelope)
+
+    logging.info("Processing packages!")
+
+    # Connecting to Ouster sensor
+    metadata = sensor_metadata(args, config)
+    with closing(open_sensor_stream(args, config, metadata)) as stream:
+        publish_scans(
+            session,
+            args,
+            stream,
+            encode_pool,
+            stop,
+            sensor_clock_synced=config.timestamp_mode
+            != client.TimestampMode.TIME_FROM_INTERNAL_OSC,
+        )
+
+
+def publish_scans(
+    session: zenoh.Session,
+    args: argparse.Namespace,
+    stream: LidarPacketAndIMUPacketScans,
+    encode_pool: EncodePool,
+    stop: threading.Event,
+    sensor_clock_synced: bool,
+):
+    """Publish the scans and IMU samples of a live packet stream under --source-id
+    until ``stop`` is set or the stream ends. Scans go through the projection and
+    encode/publish pipeline, IMU samples through their own thread."""
+
     publish_raw = args.point_cloud_format in ("raw", "both")
     publish_compressed = args.point_cloud_format in ("compressed", "both")
+    publish_points_topics = publish_raw or publish_compressed
 
     point_cloud_key = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
         subject=KEELSON_SUBJECT_POINT_CLOUD,
-        source_id=args.source_id,
+        source_id=point_cloud_source_id(args),
     )
 
-    point_cloud_compressed_key = keelson.construct_pubsub_key(
+    imu_key_acc = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED,
+        subject=KEELSON_SUBJECT_ACC,
         source_id=args.source_id,
     )
 
-    imu_key_acc = keelson.construct_pubsub_key(
+    imu_key_ang = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_ACC,
+        subject=KEELSON_SUBJECT_ANG,
         source_id=args.source_id,
     )
 
-    imu_key_ang = keelson.construct_pubsub_key(
+    metrics_key = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_ANG,
+        subject=KEELSON_SUBJECT_METRICS,
         source_id=args.source_id,
     )
 
@@ -297,10 +1443,9 @@ def from_sensor(session: zenoh.Session, args: argparse.Namespace):
     # )
 
     logging.info("PUB key: %s, %s", imu_key_acc, imu_key_ang)
+    logging.info("PUB key: %s", metrics_key)
     if publish_raw:
         logging.info("PUB key: %s", point_cloud_key)
-    if publish_compressed:
-        logging.info("PUB key: %s (decimate=%s)", point_cloud_compressed_key, args.decimate)
     # logging.info("PUB key: %s", config_key)
     # logging.info("Query key: %s", query_config_key)
 
@@ -316,6 +1461,12 @@ def from_sensor(session: zenoh.Session, args: argparse.Namespace):
         congestion_control=zenoh.CongestionControl.DROP,
     )
 
+    metrics_publisher = session.declare_publisher(
+        metrics_key,
+        priority=zenoh.Priority.DATA_LOW,
+        congestion_control=zenoh.CongestionControl.DROP,
+    )
+
     point_cloud_publisher = (
         session.declare_publisher(
             point_cloud_key,
@@ -327,13 +1478,14 @@ def from_sensor(session: zenoh.Session, args: argparse.Namespace):
     )
 
     point_cloud_compressed_publisher = (
-        session.declare_publisher(
-            point_cloud_compressed_key,
-            priority=zenoh.Priority.INTERACTIVE_HIGH,
-            congestion_control=zenoh.CongestionControl.DROP,
-        )
-        if publish_compressed
-        else None
+        declare_compressed_publishers(session, args) if publish_compressed else None
+    )
+    point_cloud_publisher, point_cloud_compressed_publisher = share_memory(
+        args, point_cloud_publisher, point_cloud_compressed_publisher
+    )
+    point_cloud_watches = (
+        watch_publisher(point_cloud_publisher, not args.eager_encoding),
+        watch_publisher(point_cloud_compressed_publisher, not args.eager_encoding),
     )
 
     # publisher_config = session.declare_publisher(
@@ -344,130 +1496,199 @@ def from_sensor(session: zenoh.Session, args: argparse.Namespace):
 
     # query_get_config = session.declare_queryable(query_config_key, sensor_config)
 
-    logging.info("Apply configuration...")
-    apply_config = client.SensorConfig()
-    apply_config.azimuth_window = (
-        args.view_angle_deg_start * 1000,
-        args.view_angle_deg_end * 1000,
-    )
-    apply_config.lidar_mode = client.LidarMode.from_string(args.lidar_mode)
-    apply_config.operating_mode = client.OperatingMode.from_string(
-        "NORMAL"
-    )  # Always set to normal mode to start up the lidar
-    client.set_config(args.ouster_hostname, apply_config, persist=True)
-
-    logging.info("Connecting to Ouster sensor...")
-
-    # Connect with the Ouster sensor and start processing lidar scans
-    config = client.get_config(args.ouster_hostname)
-
-    logging.info(f"Sensor configuration:{config}")
-
-    ingress_timestamp = time.time_ns()
-    # payload = ConfigurationSensorPerception()
-    # ConfigurationSensorPerception.SensorType.Value("LIDAR")
-    # if str(config.operating_mode.name) == "NORMAL":
-    #     ConfigurationSensorPerception.mode_operating.Value("RUNNING")
-    # else:
-    #     ConfigurationSensorPerception.mode_operating.Value(config.operating_mode.name)
-    # payload.mode = config.lidar_mode.name
-    # payload.timestamp.FromNanoseconds(ingress_timestamp)
-    # payload.other_json = json.dumps(str(config))
+    metadata = stream.metadata
 
-    # horizontal = (config.azimuth_window[1] - config.azimuth_window[0]) / 1000
-    # payload.view_horizontal_angel_deg = horizontal
-    # payload.view_horizontal_start_angel_deg = config.azimuth_window[0]
-    # payload.view_horizontal_end_angel_deg = config.azimuth_window[1]
+    # Precompute the destagger/cartesian projection look-up tables
+    projector = make_projector(metadata, args)
 
-    # logging.info("Sensor configuration: \n %s", payload)
-    # serialized_payload = payload.SerializeToString()
-    # envelope = keelson.enclose(serialized_payload)
-    # publisher_config.put(envelope)
-
-    logging.info("Processing packages!")
+    # With --sector-packets the point clouds are projected and published per
+    # azimuth sector as soon as it is received, instead of per frame
+    sector_projector = (
+        make_sector_projector(metadata, args) if publish_points_topics else None
+    )
+    points_projector = sector_projector or projector
+
+    # The queryable answers late joiners until it is undeclared on the way out
+    range_image_queryable = None
+    range_image_encoder = make_range_image_encoder(metadata, args)
+    if range_image_encoder is not None:
+        range_image_publishers, range_image_queryable = start_range_image_transport(
+            session, args, range_image_encoder
+        )
 
-    # Connecting to Ouster sensor
-    with closing(
-        LidarPacketAndIMUPacketScans.stream(
-            args.ouster_hostname, config.udp_port_lidar, complete=True
+    controller = make_compression_controller(metadata, args)
+    raw_codec = make_raw_codec(args)
+
+    # Every scan (or sector of one) in the pipeline holds a reference to its pooled
+    # buffer until it is published or dropped
+    scan_pool = make_scan_pool(stream, args)
+
+    metrics = Metrics(sensor_clock_synced=sensor_clock_synced)
+
+    # Ingestion (packet batching) runs on this thread and hands complete scans to
+    # the projection and encode/publish stages through bounded queues, so a slow
+    # encode never stalls the UDP reads.
+    def _project(item):
+        lidar_scan, ingested_at, sector = item
+        points = None
+        # Decided once per frame, nothing is projected for topics nobody listens to
+        publishers = subscribed(*point_cloud_watches)
+        wants_points = sector is not None or (
+            publish_points_topics and sector_projector is None
         )
-    ) as stream:
-        # Create a look-up table to cartesian projection
-        xyz_lut = client.XYZLut(stream.metadata)
+        try:
+            if wants_points and not any(publishers):
+                metrics.count("points_unsubscribed")
+            elif sector is not None:
+                with metrics.timed("project_sector"):
+                    points = sector_projector.project(
+                        lidar_scan, sector["start_column"]
+                    )
+            elif wants_points:
+                with metrics.timed("project"):
+                    points = lidarscan_to_points(lidar_scan, projector)
+        except Exception:
+            scan_pool.release(lidar_scan)
+            raise
+        return lidar_scan, ingested_at, sector, points, publishers
+
+    def _publish(item):
+        lidar_scan, ingested_at, sector, points, publishers = item
+        try:
+            if range_image_encoder is not None and sector is None:
+                publish_range_images(
+                    lidar_scan,
+                    range_image_encoder,
+                    range_image_publishers,
+                    args,
+                    metrics,
+                    ingested_at,
+                )
+            if points is not None:
+                publish_points(
+                    points,
+                    lidar_scan,
+                    *publishers,
+                    args,
+                    metrics,
+                    ingested_at,
+                    encode_pool,
+                    controller,
+                    sector,
+                    raw_codec=raw_codec,
+                )
+        finally:
+            _release(item)
+
+    def _release(item):
+        # Published or dropped, the scan and the points buffer can be reused
+        scan_pool.release(item[0])
+        if len(item) > 3 and item[3] is not None:
+            points_projector.release(item[3])
+
+    def _on_sector(lidar_scan, start_column, stop_column):
+        if not any(subscribed(*point_cloud_watches)):
+            metrics.count("points_unsubscribed")
+            return
+        sector = scan_sector(
+            lidar_scan, start_column, stop_column, sector_projector.sector_columns
+        )
+        scan_pool.retain(lidar_scan)
+        pipeline.put((lidar_scan, time.monotonic(), sector))
 
-        for imu_data, lidar_scan in stream:
-            if imu_data is not None:
-                payload_acc, payload_ang = imu_data_to_imu_proto_payload(imu_data, args)
+    if sector_projector is not None:
+        stream.with_sectors(args.sector_packets, _on_sector)
 
-                serialized_payload = payload_acc.SerializeToString()
-                envelope = keelson.enclose(serialized_payload)
-                imu_publisher_acc.put(envelope)
+    imu_pipeline = start_imu_path(imu_publisher_acc, imu_publisher_ang, args, metrics)
 
-                serialized_payload = payload_ang.SerializeToString()
-                envelope = keelson.enclose(serialized_payload)
-                imu_publisher_ang.put(envelope)
+    pipeline = Pipeline(args.queue_size, args.queue_policy)
+    pipeline.add_stage("project", _project, on_drop=_release)
+    pipeline.add_stage("publish", _publish, on_drop=_release)
+    pipeline.start()
 
-                logging.info("...published IMU to zenoh!")
+    report_interval = args.metrics_interval or math.inf
+    next_report_at = time.monotonic() + report_interval
 
-            if lidar_scan is not None:
-                points = lidarscan_to_points(lidar_scan, xyz_lut, stream.metadata)
+    try:
+        for imu_data, lidar_scan in stream:
+            if stop.is_set():
+                break
 
-                if point_cloud_publisher is not None:
-                    payload = points_to_pointcloud_proto_payload(
-                        points, lidar_scan, args.frame_id
-                    )
-                    point_cloud_publisher.put(
-                        keelson.enclose(payload.SerializeToString())
-                    )
-                    logging.info("...published LIDAR to zenoh!")
+            if imu_data is not None:
+                imu_pipeline.put((imu_data, time.monotonic()))
 
-                if point_cloud_compressed_publisher is not None:
-                    payload = points_to_compressed_proto_payload(
-                        points, lidar_scan, args
-                    )
-                    point_cloud_compressed_publisher.put(
-                        keelson.enclose(payload.SerializeToString())
-                    )
-                    logging.info("...published compressed LIDAR to zenoh!")
+            # Whole frames are still needed for the range images
+            if lidar_scan is not None and (
+                sector_projector is None or range_image_encoder is not None
+            ):
+                scan_pool.retain(lidar_scan)
+                pipeline.put((lidar_scan, time.monotonic(), None))
+
+            if time.monotonic() >= next_report_at:
+                report_metrics(
+                    metrics,
+                    metrics_publisher,
+                    stream,
+                    encode_pool,
+                    points_projector,
+                    imu_pipeline,
+                    pipeline,
+                )
+                next_report_at += report_interval
+    finally:
+        imu_pipeline.close()
+        pipeline.close()
+        close_watches(*point_cloud_watches)
+        if range_image_queryable is not None:
+            range_image_queryable.undeclare()
+        report_metrics(
+            metrics,
+            metrics_publisher,
+            stream,
+            encode_pool,
+            points_projector,
+            imu_pipeline,
+            pipeline,
+        )
 
 
 def from_pcap(session: zenoh.Session, args: argparse.Namespace):
     publish_raw = args.point_cloud_format in ("raw", "both")
     publish_compressed = args.point_cloud_format in ("compressed", "both")
+    publish_points_topics = publish_raw or publish_compressed
 
     point_cloud_key = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
         subject=KEELSON_SUBJECT_POINT_CLOUD,
-        source_id=args.source_id,
+        source_id=point_cloud_source_id(args),
     )
 
-    point_cloud_compressed_key = keelson.construct_pubsub_key(
+    imu_key_acc = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_POINT_CLOUD_COMPRESSED,
+        subject=KEELSON_SUBJECT_ACC,
         source_id=args.source_id,
     )
 
-    imu_key_acc = keelson.construct_pubsub_key(
+    imu_key_ang = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_ACC,
+        subject=KEELSON_SUBJECT_ANG,
         source_id=args.source_id,
     )
 
-    imu_key_ang = keelson.construct_pubsub_key(
+    metrics_key = keelson.construct_pubsub_key(
         base_path=args.realm,
         entity_id=args.entity_id,
-        subject=KEELSON_SUBJECT_ANG,
+        subject=KEELSON_SUBJECT_METRICS,
         source_id=args.source_id,
     )
 
     logging.info("IMU key: %s, %s", imu_key_acc, imu_key_ang)
+    logging.info("Metrics key: %s", metrics_key)
     if publish_raw:
         logging.info("PointCloud key: %s", point_cloud_key)
-    if publish_compressed:
-        logging.info("PointCloud compressed key: %s (decimate=%s)", point_cloud_compressed_key, args.decimate)
 
     imu_publisher_acc = session.declare_publisher(
         imu_key_acc,
@@ -481,6 +1702,12 @@ def from_pcap(session: zenoh.Session, args: argparse.Namespace):
         congestion_control=zenoh.CongestionControl.DROP,
     )
 
+    metrics_publisher = session.declare_publisher(
+        metrics_key,
+        priority=zenoh.Priority.DATA_LOW,
+        congestion_control=zenoh.CongestionControl.DROP,
+    )
+
     point_cloud_publisher = (
         session.declare_publisher(
             point_cloud_key,
@@ -492,13 +1719,14 @@ def from_pcap(session: zenoh.Session, args: argparse.Namespace):
     )
 
     point_cloud_compressed_publisher = (
-        session.declare_publisher(
-            point_cloud_compressed_key,
-            priority=zenoh.Priority.INTERACTIVE_HIGH,
-            congestion_control=zenoh.CongestionControl.DROP,
-        )
-        if publish_compressed
-        else None
+        declare_compressed_publishers(session, args) if publish_compressed else None
+    )
+    point_cloud_publisher, point_cloud_compressed_publisher = share_memory(
+        args, point_cloud_publisher, point_cloud_compressed_publisher
+    )
+    point_cloud_watches = (
+        watch_publisher(point_cloud_publisher, not args.eager_encoding),
+        watch_publisher(point_cloud_compressed_publisher, not args.eager_encoding),
     )
 
     logging.info("Reading files...")
@@ -507,66 +1735,173 @@ def from_pcap(session: zenoh.Session, args: argparse.Namespace):
         metadata = client.SensorInfo(f.read())
         logging.info("Read metadata from %s", args.metadata_file)
 
-    pcap_source = pcap.Pcap(args.pcap_file, metadata)
-    logging.info("Loaded pcap file: %s", args.pcap_file)
+    pcap_source = open_pcap(
+        args.pcap_file, metadata, start=args.start, end=args.end, loop=args.loop
+    )
+
+    # Pace the replay by the packet capture timestamps unless asked to go flat out
+    rate = 0.0 if args.max_throughput else args.rate
+    logging.info("Replay rate: %s", f"{rate}x" if rate else "max throughput")
+
+    projector = make_projector(metadata, args)
 
-    xyz_lut = client.XYZLut(metadata)
+    # With --sector-packets the point clouds are projected and published per azimuth
+    # sector as soon as it is replayed, instead of per frame
+    sector_projector = (
+        make_sector_projector(metadata, args) if publish_points_topics else None
+    )
+    points_projector = sector_projector or projector
+
+    # The queryable answers late joiners until it is undeclared on the way out
+    range_image_queryable = None
+    range_image_encoder = make_range_image_encoder(metadata, args)
+    if range_image_encoder is not None:
+        range_image_publishers, range_image_queryable = start_range_image_transport(
+            session, args, range_image_encoder
+        )
 
-    scans = LidarPacketAndIMUPacketScans(source=pcap_source)
+    # No timeout, slow replay rates legitimately leave long gaps between scans
+    scans = LidarPacketAndIMUPacketScans(
+        source=PacedPacketSource(pcap_source, rate),
+        timeout=None,
+        fields=scan_fields(metadata, args),
+    )
     logging.info("Created scans generator for %s", args.pcap_file)
 
-    try:
-        for imu_data, lidar_scan in scans:
-            # TODO: We need to account for the timestamps and send the messages back in "real-time" not fast-time
+    # Scans are published before the next one is batched, the pool only ever hands
+    # out the same one or two buffers
+    make_scan_pool(scans, args)
 
-            if imu_data is not None:
-                payload_acc, payload_ang = imu_data_to_imu_proto_payload(imu_data, args)
+    encode_pool = EncodePool(args.encode_workers, args.encode_backend)
 
-                serialized_payload = payload_acc.SerializeToString()
-                logging.debug("...serialized.")
+    controller = make_compression_controller(metadata, args)
+    raw_codec = make_raw_codec(args)
 
-                envelope = keelson.enclose(serialized_payload)
-                logging.debug("...enclosed into envelope, serialized as: %s", envelope)
+    # Recorded sensor timestamps are never on the clock of the replaying host
+    metrics = Metrics(sensor_clock_synced=False)
 
-                imu_publisher_acc.put(envelope)
+    imu_pipeline = start_imu_path(imu_publisher_acc, imu_publisher_ang, args, metrics)
 
-                serialized_payload = payload_ang.SerializeToString()
-                logging.debug("...serialized.")
+    def _on_sector(lidar_scan, start_column, stop_column):
+        ingested_at = time.monotonic()
+        publishers = subscribed(*point_cloud_watches)
+        if not any(publishers):
+            metrics.count("points_unsubscribed")
+            return
+        sector = scan_sector(
+            lidar_scan, start_column, stop_column, sector_projector.sector_columns
+        )
+        with metrics.timed("project_sector"):
+            points = sector_projector.project(lidar_scan, start_column)
+        publish_points(
+            points,
+            lidar_scan,
+            *publishers,
+            args,
+            metrics,
+            ingested_at,
+            encode_pool,
+            controller,
+            sector,
+            raw_codec=raw_codec,
+        )
+        sector_projector.release(points)
 
-                envelope = keelson.enclose(serialized_payload)
-                logging.debug("...enclosed into envelope, serialized as: %s", envelope)
+    if sector_projector is not None:
+        scans.with_sectors(args.sector_packets, _on_sector)
 
-                imu_publisher_ang.put(envelope)
+    replay_start = time.monotonic()
+    report_interval = args.metrics_interval or math.inf
+    next_report_at = replay_start + report_interval
+    frames = 0
 
-                logging.info("...published to zenoh!")
+    try:
+        for imu_data, lidar_scan in scans:
+            if imu_data is not None:
+                imu_pipeline.put((imu_data, time.monotonic()))
 
             if lidar_scan is not None:
-                points = lidarscan_to_points(lidar_scan, xyz_lut, metadata)
-
-                if point_cloud_publisher is not None:
-                    payload = points_to_pointcloud_proto_payload(
-                        points, lidar_scan, args.frame_id
-                    )
-                    point_cloud_publisher.put(
-                        keelson.enclose(payload.SerializeToString())
-                    )
-                    logging.info("...published LIDAR to zenoh!")
-
-                if point_cloud_compressed_publisher is not None:
-                    payload = points_to_compressed_proto_payload(
-                        points, lidar_scan, args
+                ingested_at = time.monotonic()
+                if range_image_encoder is not None:
+                    publish_range_images(
+                        lidar_scan,
+                        range_image_encoder,
+                        range_image_publishers,
+                        args,
+                        metrics,
+                        ingested_at,
                     )
-                    point_cloud_compressed_publisher.put(
-                        keelson.enclose(payload.SerializeToString())
+                whole_frame_points = publish_points_topics and sector_projector is None
+                publishers = subscribed(*point_cloud_watches)
+                if whole_frame_points and not any(publishers):
+                    metrics.count("points_unsubscribed")
+                elif whole_frame_points:
+                    with metrics.timed("project"):
+                        points = lidarscan_to_points(lidar_scan, projector)
+                    publish_points(
+                        points,
+                        lidar_scan,
+                        *publishers,
+                        args,
+                        metrics,
+                        ingested_at,
+                        encode_pool,
+                        controller,
+                        raw_codec=raw_codec,
                     )
-                    logging.info("...published compressed LIDAR to zenoh!")
+                    projector.release(points)
+                frames += 1
+
+            if time.monotonic() >= next_report_at:
+                report_metrics(
+                    metrics,
+                    metrics_publisher,
+                    scans,
+                    encode_pool,
+                    points_projector,
+                    imu_pipeline,
+                )
+                logging.info(
+                    "Replayed %d scans at %.1f frames/s",
+                    frames,
+                    frames / (time.monotonic() - replay_start),
+                )
+                next_report_at += report_interval
 
     except ClientTimeout:
         logging.info("Timeout occurred while waiting for packets.")
+    finally:
+        imu_pipeline.close()
+        encode_pool.close()
+        scans.close()
+        close_watches(*point_cloud_watches)
+        if range_image_queryable is not None:
+            range_image_queryable.undeclare()
+        report_metrics(
+            metrics,
+            metrics_publisher,
+            scans,
+            encode_pool,
+            points_projector,
+            imu_pipeline,
+        )
+
+        elapsed = time.monotonic() - replay_start
+        # The result of a --max-throughput run, shown at the default log level too
+        logging.log(
+            logging.WARNING if args.max_throughput else logging.INFO,
+            "Replayed %d scans in %.2f s (%.1f frames/s)",
+            frames,
+            elapsed,
+            frames / elapsed if elapsed > 0 else 0.0,
+        )
 
 
 if __name__ == "__main__":
 
+    # Imported here, it imports the subcommands from this module itself
+    import terminal_inputs
+
     args = terminal_inputs.terminal_inputs()
 
     # Setup logger
@@ -576,18 +1911,22 @@ if __name__ == "__main__":
     logging.captureWarnings(True)
     warnings.filterwarnings("once")
 
-    ## Construct session
-    logging.info("Opening Zenoh session...")
-    conf = zenoh.Config()
+    ## Construct session, offline subcommands run without one
+    session = None
+    if not getattr(args, "offline", False):
+        logging.info("Opening Zenoh session...")
+        conf = zenoh.Config()
 
-    if args.connect is not None:
-        conf.insert_json5(zenoh.config.CONNECT_KEY, json.dumps(args.connect))
-    session = zenoh.open(conf)
+        if args.shm:
+            conf.insert_json5("transport/shared_memory/enabled", "true")
+        if args.connect is not None:
+            conf.insert_json5(zenoh.config.CONNECT_KEY, json.dumps(args.connect))
+        session = zenoh.open(conf)
 
-    def _on_exit():
-        session.close()
+        def _on_exit():
+            session.close()
 
-    atexit.register(_on_exit)
+        atexit.register(_on_exit)
 
     # Dispatch to correct function
     try:
@@ -0,0 +1,96 @@
+"""
+Subscriber-aware publishing: whether anyone is subscribed to a topic, tracked with
+zenoh matching listeners, so the work for topics nobody listens to can be skipped
+"""
+
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import zenoh
+
+
+class SubscriberWatch:
+    """Tracks whether subscribers match the key of a publisher. Calling the watch
+    gives the publisher while they do and None otherwise.
+
+    The status is kept up to date by a zenoh matching listener, so checking it costs
+    nothing and a new subscriber is noticed with the next frame. A watch that is not
+    ``lazy`` always gives the publisher, one of no publisher always None."""
+
+    def __init__(self, publisher: Optional[Any], lazy: bool = True):
+        self.publisher = publisher
+        self.matching = publisher is not None
+        self._listener = None
+
+        if publisher is not None and lazy:
+            self.matching = publisher.matching_status.matching
+            self._listener = publisher.declare_matching_listener(self._on_status)
+            logging.info(
+                "%s: %s subscribers",
+                publisher.key_expr,
+                "has" if self.matching else "no",
+            )
+
+    def _on_status(self, status: zenoh.MatchingStatus):
+        self.matching = status.matching
+        logging.info(
+            "%s: subscribers %s",
+            self.publisher.key_expr,
+            "appeared, resuming" if status.matching else "gone, pausing",
+        )
+
+    def __call__(self) -> Optional[Any]:
+        return self.publisher if self.matching else None
+
+    def close(self):
+        """Undeclares the matching listener, whose thread keeps the process alive"""
+
+        if self._listener is not None:
+            self._listener.undeclare()
+            self._listener = None
+
+
+class LevelWatches:
+    """SubscriberWatches of the publishers of the levels of detail of a topic, by
+    level. Calling gives the publishers of the levels with subscribers, by level, or
+    None while no level has any."""
+
+    def __init__(self, publishers: Dict[int, Any], lazy: bool = True):
+        self.watches = {
+            level: SubscriberWatch(publisher, lazy)
+            for level, publisher in publishers.items()
+        }
+
+    def __call__(self) -> Optional[Dict[int, Any]]:
+        levels = {level: watch() for level, watch in self.watches.items()}
+        subscribed_levels = {
+            level: publisher
+            for level, publisher in levels.items()
+            if publisher is not None
+        }
+        return subscribed_levels or None
+
+    def close(self):
+        for watch in self.watches.values():
+            watch.close()
+
+
+def watch_publisher(publisher, lazy: bool = True):
+    """SubscriberWatch of a publisher, or LevelWatches of the publishers of the
+    levels of detail of a topic given by level"""
+
+    if isinstance(publisher, dict):
+        return LevelWatches(publisher, lazy)
+    return SubscriberWatch(publisher, lazy)
+
+
+def subscribed(*watches) -> Tuple[Optional[Any], ...]:
+    """The publishers of the (level) watches, None for those without subscribers"""
+    return tuple(watch() for watch in watches)
+
+
+def close_watches(*watches):
+    """Closes the (level) watches"""
+
+    for watch in watches:
+        watch.close()
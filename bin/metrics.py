@@ -0,0 +1,88 @@
+"""
+Lightweight hot-path instrumentation: per-stage timings and counters collected from any
+thread and summarized periodically into a compact metrics report
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator
+
+import numpy as np
+
+# Most recent samples kept per timing between two reports
+MAX_SAMPLES = 4096
+
+
+class Metrics:
+    """Thread-safe collection of timings (in seconds), monotonic counters and gauges
+    (last reported values).
+
+    Timings are summarized and cleared by ``snapshot``, counters keep counting.
+    ``sensor_clock_synced`` tells whether the sensor timestamps are on the same clock
+    as this host (PTP/GPS synchronized), which is needed for sensor-to-put latency."""
+
+    def __init__(self, sensor_clock_synced: bool = False):
+        self.sensor_clock_synced = sensor_clock_synced
+        self._timings: Dict[str, Deque[float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._since = time.monotonic()
+
+    def observe(self, name: str, seconds: float):
+        """Record one timing sample"""
+        with self._lock:
+            samples = self._timings.get(name)
+            if samples is None:
+                samples = self._timings[name] = deque(maxlen=MAX_SAMPLES)
+            samples.append(seconds)
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        """Record the wall time spent in the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name: str, n: int = 1):
+        """Increment a counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def gauge(self, name: str, value: Any):
+        """Set the current (JSON serializable) value of a gauge"""
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Summaries (in milliseconds) of the timings recorded since the previous
+        snapshot, together with the current counter and gauge values"""
+
+        with self._lock:
+            timings, self._timings = self._timings, {}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            now = time.monotonic()
+            interval, self._since = now - self._since, now
+
+        summaries = {}
+        for name, samples in timings.items():
+            ms = np.fromiter(samples, float, len(samples)) * 1e3
+            summaries[name] = {
+                "n": len(ms),
+                "mean": round(float(ms.mean()), 3),
+                "p50": round(float(np.percentile(ms, 50)), 3),
+                "p99": round(float(np.percentile(ms, 99)), 3),
+                "max": round(float(ms.max()), 3),
+            }
+
+        return {
+            "interval_s": round(interval, 3),
+            "timings_ms": summaries,
+            "counters": counters,
+            "gauges": gauges,
+        }
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+"""
+Memory-mapped pcap reader with a frame index: the byte offset, frame id and capture
+time of every lidar frame of a recording, built once and cached next to it, so that a
+time range or any frame is reached without reading the packets before it
+"""
+
+import os
+import sys
+import mmap
+import struct
+import logging
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from ouster.sdk import pcap
+from ouster.sdk.client import ImuPacket, LidarPacket, PacketSource, SensorInfo
+from ouster.sdk.client import _client
+
+Packet = Union[LidarPacket, ImuPacket]
+
+# One entry per lidar frame, in recording order
+INDEX_DTYPE = np.dtype(
+    [("offset", np.int64), ("frame_id", np.int64), ("timestamp", np.float64)]
+)
+
+# Suffix of the cached index, next to the pcap file
+INDEX_SUFFIX = ".index.npz"
+
+# Bumped whenever the cached index changes meaning
+INDEX_VERSION = 1
+
+# pcap magic numbers: byte order and time stamp resolution (fractions of a second)
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+
+# pcapng section header block, read without an index by the pcap reader of ouster-sdk
+PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+
+PCAP_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+
+# Supported link layer types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_RAW = 101
+LINKTYPE_IPV4 = 228
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = 0x8100
+IP_PROTOCOL_UDP = 17
+UDP_HEADER_SIZE = 8
+
+# (record offset, capture time, UDP payload) of a datagram
+Datagram = Tuple[int, float, Union[memoryview, bytes]]
+
+
+def index_path(pcap_file: str) -> str:
+    """Where the frame index of a pcap file is cached"""
+    return pcap_file + INDEX_SUFFIX
+
+
+class _Fragments:
+    """IPv4 fragments of one datagram being reassembled"""
+
+    def __init__(self, record_offset: int):
+        self.record_offset = record_offset
+        self.parts: Dict[int, bytes] = {}
+        self.size: Optional[int] = None
+
+    def add(
+        self, fragment_offset: int, data: memoryview, more: bool
+    ) -> Optional[bytes]:
+        self.parts[fragment_offset] = bytes(data)
+        if not more:
+            self.size = fragment_offset + len(data)
+        if self.size is None or sum(map(len, self.parts.values())) < self.size:
+            return None
+        return b"".join(self.parts[offset] for offset in sorted(self.parts))
+
+
+class IndexedPcap:
+    """Packet source of the lidar and IMU packets of a (classic, not pcapng) pcap
+    file, memory mapped and read from the frame index.
+
+    ``start`` and ``end`` select the frames captured from/until that many seconds
+    after the first frame of the recording, reached by a lookup in the index rather
+    than by reading up to them. With ``loop`` the selection is replayed forever.
+    The index is read from its cache next to the file, or built with one pass over
+    the file and cached there, when missing or stale.
+
+    Packets are told apart by size as in ouster-sdk. As with client.Sensor, a yielded
+    packet is only valid until the next one is requested."""
+
+    def __init__(
+        self,
+        pcap_file: str,
+        metadata: SensorInfo,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        loop: bool = False,
+    ):
+        self._metadata = metadata
+        self._loop = loop
+        self._pf = _client.PacketFormat.from_info(metadata)
+        self._lidar_packet = LidarPacket(packet_format=self._pf)
+        self._imu_packet = ImuPacket(packet_format=self._pf)
+
+        self._file = open(pcap_file, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic = bytes(self._mmap[:4])
+        if magic not in PCAP_MAGIC:
+            self.close()
+            raise ValueError(f"{pcap_file} is not a (classic) pcap file")
+        self._endian, self._resolution = PCAP_MAGIC[magic]
+        self._linktype = struct.unpack_from(self._endian + "I", self._mmap, 20)[0]
+        if self._linktype not in (
+            LINKTYPE_ETHERNET,
+            LINKTYPE_LINUX_SLL,
+            LINKTYPE_RAW,
+            LINKTYPE_IPV4,
+        ):
+            self.close()
+            raise ValueError(f"Unsupported pcap link type {self._linktype}")
+
+        self.index = self._load_index(pcap_file)
+        self._start, self._stop = self.select(start, end)
+        logging.info("Loaded %s (%d frames indexed)", pcap_file, len(self.index))
+
+    @property
+    def metadata(self) -> SensorInfo:
+        """Metadata of the recorded sensor"""
+        return self._metadata
+
+    @property
+    def is_live(self) -> bool:
+        """A recording is never live"""
+        return False
+
+    def select(
+        self, start: Optional[float] = None, end: Optional[float] = None
+    ) -> Tuple[int, int]:
+        """Byte range [start, stop) of the frames captured from ``start`` until
+        ``end`` seconds after the first frame, the whole file by default"""
+
+        stop = len(self._mmap)
+        if not len(self.index):
+            return PCAP_HEADER_SIZE, stop
+
+        times = self.index["timestamp"] - self.index["timestamp"][0]
+        first = 0 if start is None else int(np.searchsorted(times, start, "left"))
+        last = len(times) if end is None else int(np.searchsorted(times, end, "right"))
+        if first >= len(times):
+            return stop, stop
+        return (
+            PCAP_HEADER_SIZE if first == 0 else int(self.index["offset"][first]),
+            stop if last >= len(times) else int(self.index["offset"][last]),
+        )
+
+    def seek(self, frame: int):
+        """Continue from frame number ``frame`` of the index with the next iteration,
+        up to the end of the selected time range"""
+
+        self._start = int(self.index["offset"][frame])
+
+    def _load_index(self, pcap_file: str) -> np.ndarray:
+        stat = os.stat(pcap_file)
+        source = np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], np.int64)
+        path = index_path(pcap_file)
+
+        try:
+            with np.load(path) as cached:
+                if np.array_equal(cached["source"], source):
+                    return cached["frames"]
+            logging.info("Frame index %s is stale, rebuilding it", path)
+        except (OSError, KeyError, ValueError):
+            logging.info("No frame index at %s, building it", path)
+
+        frames = self.build_index()
+        try:
+            with open(path, "wb") as f:
+                np.savez(f, frames=frames, source=source)
+            logging.info("Cached the index of %d frames at %s", len(frames), path)
+        except OSError as error:
+            logging.warning("Could not cache the frame index at %s: %s", path, error)
+        return frames
+
+    def build_index(self) -> np.ndarray:
+        """Frame index of the whole file: one entry per lidar frame, from the first
+        pcap record of its first packet"""
+
+        lidar_size = self._pf.lidar_packet_size
+        entries: List[Tuple[int, int, float]] = []
+        previous = None
+        for offset, timestamp, payload in self._datagrams(
+            PCAP_HEADER_SIZE, len(self._mmap)
+        ):
+            if len(payload) != lidar_size:
+                continue
+            frame_id = self._pf.frame_id(np.frombuffer(payload, np.uint8))
+            if frame_id != previous:
+                entries.append((offset, frame_id, timestamp))
+                previous = frame_id
+        return np.array(entries, INDEX_DTYPE)
+
+    def _ip_packet(self, frame: memoryview) -> Optional[memoryview]:
+        # The IPv4 packet of a link layer frame, if any
+        if self._linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+            return frame
+        if self._linktype == LINKTYPE_LINUX_SLL:
+            ethertype, header = struct.unpack_from(">H", frame, 14)[0], 16
+        else:
+            ethertype, header = struct.unpack_from(">H", frame, 12)[0], 14
+            while ethertype == ETHERTYPE_VLAN:
+                ethertype = struct.unpack_from(">H", frame, header + 2)[0]
+                header += 4
+        return frame[header:] if ethertype == ETHERTYPE_IPV4 else None
+
+    def _datagrams(self, start: int, stop: int) -> Iterator[Datagram]:
+        # UDP payloads of the records in [start, stop), reassembled from their IPv4
+        # fragments, each with the offset of its first record. Records are copied out
+        # of the mapping, no buffer exported from it outlives the iteration.
+        record_header = self._endian + "IIII"
+        fragments: Dict[Tuple[bytes, int], _Fragments] = {}
+        offset = start
+        while offset + RECORD_HEADER_SIZE <= stop:
+            seconds, fraction, captured, _ = struct.unpack_from(
+                record_header, self._mmap, offset
+            )
+            record_offset = offset
+            offset += RECORD_HEADER_SIZE + captured
+            if offset > stop:
+                break
+
+            ip = self._ip_packet(memoryview(self._mmap[offset - captured : offset]))
+            if ip is None or len(ip) < 20 or ip[0] >> 4 != 4:
+                continue
+            ihl = (ip[0] & 0x0F) * 4
+            total_length, ident, flags_offset, _, protocol = struct.unpack_from(
+                ">HHHBB", ip, 2
+            )
+            if protocol != IP_PROTOCOL_UDP:
+                continue
+            data = ip[ihl:total_length]
+            more = bool(flags_offset & 0x2000)
+            fragment_offset = (flags_offset & 0x1FFF) * 8
+            timestamp = seconds + fraction * self._resolution
+
+            if not more and fragment_offset == 0:
+                yield record_offset, timestamp, data[UDP_HEADER_SIZE:]
+                continue
+
+            key = (bytes(ip[12:20]), ident)
+            if key not in fragments:
+                fragments[key] = _Fragments(record_offset)
+            datagram = fragments[key].add(fragment_offset, data, more)
+            if datagram is not None:
+                first = fragments.pop(key).record_offset
+                yield first, timestamp, datagram[UDP_HEADER_SIZE:]
+
+    def __iter__(self) -> Iterator[Packet]:
+        sizes = {
+            self._pf.lidar_packet_size: self._lidar_packet,
+            self._pf.imu_packet_size: self._imu_packet,
+        }
+        while True:
+            for _, timestamp, payload in self._datagrams(self._start, self._stop):
+                packet = sizes.get(len(payload))
+                if packet is None:
+                    continue
+                packet._data[:] = np.frombuffer(payload, np.uint8)
+                packet.capture_timestamp = timestamp
+                yield packet
+            if not self._loop:
+                return
+
+    def close(self):
+        """Unmap and close the file"""
+        self._mmap.close()
+        self._file.close()
+
+
+def open_pcap(
+    pcap_file: str,
+    metadata: SensorInfo,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    loop: bool = False,
+) -> PacketSource:
+    """Packet source of a recording: an IndexedPcap of a classic pcap file, the pcap
+    reader of ouster-sdk for a pcapng file. The latter has no frame index, a time
+    range is only supported on classic pcap files."""
+
+    with open(pcap_file, "rb") as f:
+        magic = f.read(len(PCAPNG_MAGIC))
+    if magic != PCAPNG_MAGIC:
+        return IndexedPcap(pcap_file, metadata, start=start, end=end, loop=loop)
+
+    if start is not None or end is not None:
+        raise ValueError(
+            f"{pcap_file} is a pcapng file, a time range needs a classic pcap file "
+            "(convert it with: editcap -F pcap <pcapng-file> <pcap-file>)"
+        )
+    logging.warning("%s is a pcapng file, reading it without a frame index", pcap_file)
+    return pcap.Pcap(pcap_file, metadata, loop=loop)
+
+
+def run():
+    """Build (or rebuild) and summarize the frame index of a pcap file"""
+
+    parser = argparse.ArgumentParser(
+        prog="pcap_index",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-p", "--pcap-file", type=str, required=True)
+    parser.add_argument("-m", "--metadata-file", type=str, required=True)
+    parser.add_argument("--rebuild", action="store_true")
+    parser.add_argument("--log-level", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s", level=args.log_level
+    )
+
+    with open(args.metadata_file, "r") as f:
+        metadata = SensorInfo(f.read())
+
+    if args.rebuild and os.path.exists(index_path(args.pcap_file)):
+        os.remove(index_path(args.pcap_file))
+
+    source = IndexedPcap(args.pcap_file, metadata)
+    try:
+        frames = source.index
+        duration = np.ptp(frames["timestamp"]) if len(frames) else 0.0
+        print(f"{len(frames)} frames over {duration:.2f} s in {args.pcap_file}")
+    finally:
+        source.close()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
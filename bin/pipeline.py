@@ -0,0 +1,174 @@
+"""
+Bounded, thread-backed processing stages used to decouple packet ingestion from
+projection, encoding and publishing of lidar scans
+"""
+
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+QUEUE_POLICIES = ("drop-oldest", "block")
+
+# Returned by StageQueue.get once the queue is closed and drained
+CLOSED = object()
+
+
+class StageQueue:
+    """Bounded FIFO between two stages.
+
+    With the "drop-oldest" policy a put never blocks; when the queue is full the
+    oldest item is evicted (and handed to ``on_drop``) to make room for the new one.
+    With the "block" policy the producer waits for free space instead."""
+
+    def __init__(
+        self,
+        maxsize: int,
+        policy: str = "drop-oldest",
+        on_drop: Optional[Callable[[Any], None]] = None,
+    ):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown queue policy: {policy}")
+
+        self._maxsize = max(1, maxsize)
+        self._policy = policy
+        self._on_drop = on_drop
+        self._items: Deque[Any] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of items currently waiting in the queue"""
+        return len(self._items)
+
+    def put(self, item: Any):
+        """Enqueue an item according to the queue policy"""
+        evicted = None
+        with self._cond:
+            if self._policy == "block":
+                while len(self._items) >= self._maxsize and not self._closed:
+                    self._cond.wait()
+            elif len(self._items) >= self._maxsize:
+                evicted = self._items.popleft()
+                self.dropped += 1
+
+            self._items.append(item)
+            self._cond.notify_all()
+
+        if evicted is not None and self._on_drop is not None:
+            self._on_drop(evicted)
+
+    def get(self) -> Any:
+        """Dequeue the next item, blocking until one is available. Returns CLOSED
+        once the queue has been closed and drained."""
+        with self._cond:
+            while not self._items and not self._closed:
+                self._cond.wait()
+
+            if not self._items:
+                return CLOSED
+
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        """Stop accepting new work, consumers drain what is left"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Stage(threading.Thread):
+    """Worker thread applying ``func`` to every item of ``inbox`` and forwarding
+    non-None results to ``outbox``"""
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        inbox: StageQueue,
+        outbox: Optional[StageQueue] = None,
+    ):
+        super().__init__(name=f"stage-{name}", daemon=True)
+        self.stage_name = name
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.errors = 0
+
+    def run(self):
+        while (item := self.inbox.get()) is not CLOSED:
+            try:
+                result = self.func(item)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # A single bad frame must not take the whole pipeline down
+                logging.exception("Stage %s failed to process item", self.stage_name)
+                self.errors += 1
+                continue
+
+            self.processed += 1
+            if self.outbox is not None and result is not None:
+                self.outbox.put(result)
+
+        if self.outbox is not None:
+            self.outbox.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, drop count and throughput counters of this stage"""
+        return {
+            "stage": self.stage_name,
+            "depth": self.inbox.depth,
+            "dropped": self.inbox.dropped,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
+
+
+class Pipeline:
+    """A chain of stages joined by bounded queues. Items are fed to the first stage
+    with ``put`` and flow through the stages in the order they were added."""
+
+    def __init__(self, maxsize: int = 2, policy: str = "drop-oldest"):
+        self._maxsize = maxsize
+        self._policy = policy
+        self.stages: List[Stage] = []
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable[[Any], Any],
+        on_drop: Optional[Callable[[Any], None]] = None,
+    ) -> "Pipeline":
+        """Append a stage consuming the output of the previous one. ``on_drop`` is
+        called with every item evicted from the queue in front of the stage."""
+        inbox = StageQueue(self._maxsize, self._policy, on_drop)
+        if self.stages:
+            self.stages[-1].outbox = inbox
+        self.stages.append(Stage(name, func, inbox))
+        return self
+
+    def start(self):
+        """Start all stage threads"""
+        for stage in self.stages:
+            stage.start()
+
+    def put(self, item: Any):
+        """Feed an item to the first stage"""
+        self.stages[0].inbox.put(item)
+
+    def close(self):
+        """Let the stages drain their queues and wait for them to finish"""
+        if not self.stages:
+            return
+
+        self.stages[0].inbox.close()
+        for stage in self.stages:
+            stage.join()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-stage queue depth and drop counts"""
+        return [stage.stats() for stage in self.stages]
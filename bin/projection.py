@@ -0,0 +1,316 @@
+"""
+Projection of Ouster LidarScans into destaggered point arrays using lookup tables
+precomputed once per sensor
+"""
+
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from ouster.sdk import client
+from ouster.sdk.client import LidarScan
+
+# Channels that can be carried along with XYZ by point field name, in point column
+# order
+POINT_CHANNELS: Dict[str, client.ChanField] = {
+    "signal": client.ChanField.SIGNAL,
+    "reflectivity": client.ChanField.REFLECTIVITY,
+    "near_ir": client.ChanField.NEAR_IR,
+}
+
+# Names of the point fields, in memory order
+POINT_FIELDS = ("x", "y", "z", *POINT_CHANNELS)
+
+# Per-point memory layouts: (xyz dtype, channel dtype)
+POINT_LAYOUTS: Dict[str, Tuple[type, type]] = {
+    # 48 bytes per point, everything widened to float64
+    "float64": (np.float64, np.float64),
+    # 18 bytes per point, the native precision of the sensor data
+    "packed": (np.float32, np.uint16),
+}
+
+
+def point_dtype(
+    layout: str = "float64", channels: Sequence[str] = tuple(POINT_CHANNELS)
+) -> np.dtype:
+    """Packed (unaligned) structured dtype of one point in the given layout, with XYZ
+    and the given channels"""
+    if layout not in POINT_LAYOUTS:
+        raise ValueError(f"Unknown point layout: {layout}")
+    unknown = set(channels) - set(POINT_CHANNELS)
+    if unknown:
+        raise ValueError(f"Unknown point channels: {sorted(unknown)}")
+
+    xyz_type, channel_type = POINT_LAYOUTS[layout]
+    return np.dtype(
+        [(name, xyz_type) for name in POINT_FIELDS[:3]]
+        + [(name, channel_type) for name in channels]
+    )
+
+
+def destagger_index(info: client.SensorInfo) -> np.ndarray:
+    """Flat index gathering a staggered (H, W) channel, raveled, into destaggered
+    order: destaggered[u, v] == staggered[u, (v - shift[u]) % w]"""
+
+    h = info.format.pixels_per_column
+    w = info.format.columns_per_frame
+    shifts = np.asarray(info.format.pixel_shift_by_row).reshape(-1, 1)
+    return (
+        np.arange(h).reshape(-1, 1) * w + (np.arange(w).reshape(1, -1) - shifts) % w
+    ).ravel()
+
+
+# Lookup tables computed (or loaded, see set_xyz_lut_planes) in this process, by
+# sensor metadata
+_xyz_luts: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+_xyz_luts_lock = threading.Lock()
+
+
+def xyz_lut_planes(info: client.SensorInfo) -> Tuple[np.ndarray, np.ndarray]:
+    """Direction and offset (3, H * W) float64 planes of the XYZ lookup table, in
+    destaggered order: xyz = direction * range + offset (meters, range in millimetres)
+    for every pixel with a return.
+
+    ouster-sdk does not expose both terms, so the public lookup table is probed at two
+    ranges to recover them. Computed once per sensor metadata and process, the
+    planes are shared and must not be modified."""
+
+    key = info.updated_metadata_string()
+    with _xyz_luts_lock:
+        if key not in _xyz_luts:
+            _xyz_luts[key] = _probe_xyz_lut(info)
+        return _xyz_luts[key]
+
+
+def set_xyz_lut_planes(info: client.SensorInfo, lut: Tuple[np.ndarray, np.ndarray]):
+    """Use ``lut``, e.g. read from a cache, as the xyz_lut_planes of the sensor"""
+    with _xyz_luts_lock:
+        _xyz_luts[info.updated_metadata_string()] = lut
+
+
+def _probe_xyz_lut(info: client.SensorInfo) -> Tuple[np.ndarray, np.ndarray]:
+    h = info.format.pixels_per_column
+    w = info.format.columns_per_frame
+    xyz_lut = client.XYZLut(info)
+    near = xyz_lut(np.full((h, w), 1000, np.uint32)).reshape(-1, 3)
+    far = xyz_lut(np.full((h, w), 2000, np.uint32)).reshape(-1, 3)
+    direction = (far - near) / 1000
+    offset = near - 1000 * direction
+
+    gather = destagger_index(info)
+    return direction[gather].T, offset[gather].T
+
+
+class Projector:
+    """Destaggers and projects LidarScans of one sensor into structured arrays of
+    [x, y, z, signal, reflectivity, near_ir] points (or XYZ and ``channels``), laid
+    out per ``point_dtype``.
+
+    A single flat gather index merges the per-row destagger shifts, and the XYZ lookup
+    table is stored pre-gathered in destaggered order (one contiguous plane per axis),
+    so a frame is projected with one take per channel and a few vectorized passes
+    straight into a preallocated output buffer. Output buffers are
+    recycled: hand them back with ``release`` once the points have been published.
+
+    Only the ``channels`` given (by point field name) are destaggered and carried
+    along with XYZ, the scans need not have the other ones.
+
+    With ``columns`` (start, stop) only the pixels measured in those (staggered)
+    columns of the scan are projected, still in destaggered order. ``lut`` takes the
+    ``xyz_lut_planes`` of the sensor when they have been computed already.
+
+    ``project`` is not thread-safe (it reuses scratch buffers) but ``release`` may be
+    called from any thread."""
+
+    def __init__(
+        self,
+        info: client.SensorInfo,
+        layout: str = "float64",
+        drop_invalid: bool = False,
+        min_range_mm: int = 0,
+        max_range_mm: Optional[int] = None,
+        columns: Optional[Tuple[int, int]] = None,
+        lut: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+        channels: Sequence[str] = tuple(POINT_CHANNELS),
+    ):
+        self.dtype = point_dtype(layout, channels)
+        self._channels = [(name, POINT_CHANNELS[name]) for name in channels]
+        self.h = info.format.pixels_per_column
+        self.w = info.format.columns_per_frame
+
+        gather = destagger_index(info)
+        direction, offset = lut if lut is not None else xyz_lut_planes(info)
+        if columns is not None:
+            source_column = gather % self.w
+            pixels = np.flatnonzero(
+                (source_column >= columns[0]) & (source_column < columns[1])
+            )
+            gather, direction, offset = (
+                gather[pixels],
+                direction[:, pixels],
+                offset[:, pixels],
+            )
+        self._gather = gather
+        n = gather.size
+
+        # XYZ is computed in the precision of the output so it is written in place
+        xyz_type = self.dtype["x"]
+        self._direction = np.ascontiguousarray(direction, xyz_type)
+        self._offset = np.ascontiguousarray(offset, xyz_type)
+
+        # Points are kept if min_range <= range <= max_range (in sensor millimetres),
+        # no return (range 0) counts as invalid
+        self._filtered = drop_invalid or min_range_mm > 0 or max_range_mm is not None
+        self._min_range = max(min_range_mm, 1 if drop_invalid else 0)
+        self._max_range = np.inf if max_range_mm is None else max_range_mm
+
+        # Per-frame scratch buffers, channels keyed by dtype (it depends on the profile)
+        self._range = np.empty(n, xyz_type)
+        self._has_return = np.empty(n, xyz_type)
+        self._axis = np.empty(n, xyz_type)
+        self._scratch: Dict[np.dtype, np.ndarray] = {}
+        if self._filtered:
+            self._mask = np.empty(n, bool)
+            self._mask_upper = np.empty(n, bool)
+            self._kept = np.empty(0, np.intp)
+            self._kept_gather = np.empty(n, self._gather.dtype)
+            self._kept_range = np.empty(n, xyz_type)
+            self._kept_direction = np.empty(n, xyz_type)
+            self._kept_offset = np.empty(n, xyz_type)
+
+        self._free: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+        self.frames = 0
+        self.kept = 0
+        self.dropped = 0
+        self.last_kept = 0
+        self.last_dropped = 0
+
+    def _take(self, field: np.ndarray, gather: np.ndarray) -> np.ndarray:
+        # Destagger a channel into a scratch buffer of its own dtype
+        scratch = self._scratch.get(field.dtype)
+        if scratch is None:
+            scratch = self._scratch[field.dtype] = np.empty(field.size, field.dtype)
+        return np.take(field.ravel(), gather, out=scratch[: gather.size])
+
+    def _select(self) -> int:
+        # Mask the destaggered range and compact the gather index and the range of
+        # the kept pixels to the front of their scratch buffers. Indexing with the
+        # kept positions is several times faster than repeated boolean compress on
+        # the scattered masks of real scenes.
+        np.greater_equal(self._range, self._min_range, out=self._mask)
+        np.less_equal(self._range, self._max_range, out=self._mask_upper)
+        np.logical_and(self._mask, self._mask_upper, out=self._mask)
+
+        self._kept = np.flatnonzero(self._mask)
+        n = self._kept.size
+        np.take(self._gather, self._kept, out=self._kept_gather[:n])
+        np.take(self._range, self._kept, out=self._kept_range[:n])
+        return n
+
+    def _acquire(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return np.empty(self._gather.size, self.dtype)
+
+    def release(self, points: np.ndarray):
+        """Return an output buffer obtained from ``project`` for reuse"""
+        with self._lock:
+            # project hands out a view of the first kept points of the buffer
+            self._free.append(points if points.base is None else points.base)
+
+    def project(self, lidar_scan: LidarScan) -> np.ndarray:
+        """Project a scan into a (reused) structured points buffer. Without filtering
+        this holds all N pixels of the scan (of its columns), otherwise only the kept
+        points."""
+
+        out = self._acquire()
+        gather, rng = self._gather, self._range
+
+        np.copyto(rng, self._take(lidar_scan.field(client.ChanField.RANGE), gather))
+
+        n = rng.size
+        if self._filtered:
+            n = self._select()
+            gather, rng = self._kept_gather[:n], self._kept_range[:n]
+
+        # No return: the sensor reports range 0 and the point is put at the origin, so
+        # the offset term is only applied where sign(range) == 1. Not needed when those
+        # points have been dropped already.
+        has_return = None
+        if self._min_range < 1:
+            has_return = np.sign(rng, out=self._has_return[:n])
+
+        for axis, name in enumerate(POINT_FIELDS[:3]):
+            xyz, direction, offset = (
+                out[name][:n],
+                self._direction[axis],
+                self._offset[axis],
+            )
+            if self._filtered:
+                direction = np.take(direction, self._kept, out=self._kept_direction[:n])
+                offset = np.take(offset, self._kept, out=self._kept_offset[:n])
+            if has_return is not None:
+                offset = np.multiply(offset, has_return, out=self._axis[:n])
+
+            np.multiply(direction, rng, out=xyz)
+            np.add(xyz, offset, out=xyz)
+
+        for name, channel in self._channels:
+            out[name][:n] = self._take(lidar_scan.field(channel), gather)
+
+        self.frames += 1
+        self.last_kept, self.last_dropped = n, self._range.size - n
+        self.kept += self.last_kept
+        self.dropped += self.last_dropped
+
+        return out[:n]
+
+    def stats(self) -> Dict[str, int]:
+        """Number of projected frames and points kept/dropped by the range filter"""
+        return {"frames": self.frames, "kept": self.kept, "dropped": self.dropped}
+
+
+class SectorProjector:
+    """Projectors of the azimuth sectors of a sensor, consecutive runs of
+    ``sector_columns`` (staggered) columns starting at column 0, so that a sector can
+    be projected as soon as its columns have been received. Takes the arguments of
+    ``Projector`` otherwise and shares its lookup tables between the sectors."""
+
+    def __init__(self, info: client.SensorInfo, sector_columns: int, **kwargs):
+        w = info.format.columns_per_frame
+        lut = xyz_lut_planes(info)
+
+        self.sector_columns = sector_columns
+        self.projectors = [
+            Projector(
+                info, columns=(start, min(start + sector_columns, w)), lut=lut, **kwargs
+            )
+            for start in range(0, w, sector_columns)
+        ]
+
+        # Buffers of sectors of equal size are interchangeable, so a buffer is handed
+        # back to any projector of its size
+        self._by_size = {
+            projector._gather.size: projector for projector in self.projectors
+        }
+
+    def project(self, lidar_scan: LidarScan, start_column: int) -> np.ndarray:
+        """Project the sector starting at ``start_column`` of a scan, see
+        ``Projector.project``"""
+        return self.projectors[start_column // self.sector_columns].project(lidar_scan)
+
+    def release(self, points: np.ndarray):
+        """Return an output buffer obtained from ``project`` for reuse"""
+        base = points if points.base is None else points.base
+        self._by_size[base.size].release(points)
+
+    @property
+    def kept(self) -> int:
+        return sum(projector.kept for projector in self.projectors)
+
+    @property
+    def dropped(self) -> int:
+        return sum(projector.dropped for projector in self.projectors)
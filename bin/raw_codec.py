@@ -0,0 +1,107 @@
+"""
+Lossless compression of the data of the raw point cloud topic: the point records are
+byte shuffled, every byte of a record gathered into its own plane across all points,
+and the planes compressed with a fast general purpose codec
+"""
+
+import zlib
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+RAW_CODECS = ("none", "lz4", "zstd", "zlib")
+
+# Default (fast) compression level of each codec
+DEFAULT_LEVELS = {"lz4": 0, "zstd": 1, "zlib": 1}
+
+
+def _compressors(codec: str) -> Tuple[Callable[[bytes, int], bytes], Callable]:
+    """(compress(data, level), decompress(data)) of a codec, imported on first use"""
+
+    if codec == "zlib":
+        return zlib.compress, zlib.decompress
+    if codec == "lz4":
+        import lz4.frame
+
+        return (
+            lambda data, level: lz4.frame.compress(data, compression_level=level),
+            lz4.frame.decompress,
+        )
+    if codec == "zstd":
+        import zstandard
+
+        return (
+            lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+            zstandard.ZstdDecompressor().decompress,
+        )
+    raise ValueError(f"Unknown raw codec: {codec}")
+
+
+def byte_shuffle(points: np.ndarray) -> np.ndarray:
+    """Bytes of a structured points array as (itemsize, N) planes: plane k holds byte
+    k of every point. The fields of a point are contiguous, so the planes of a field
+    are adjacent and its slowly varying high bytes end up in long compressible runs."""
+
+    records = np.ascontiguousarray(points).view(np.uint8)
+    records = records.reshape(len(points), points.dtype.itemsize)
+    return np.ascontiguousarray(records.T)
+
+
+def byte_unshuffle(planes: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Inverse of ``byte_shuffle``: points of ``dtype`` from their (itemsize, N)
+    byte planes"""
+
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(-1)
+
+
+class RawCodec:
+    """Compresses structured points arrays losslessly for the raw point cloud topic.
+    ``level`` None picks the fast default of the codec, ``shuffle`` byte shuffles
+    the points first. Codec ``none`` passes the points through as is."""
+
+    def __init__(
+        self, codec: str = "zstd", level: Optional[int] = None, shuffle: bool = True
+    ):
+        if codec not in RAW_CODECS:
+            raise ValueError(f"Unknown raw codec: {codec}")
+
+        self.codec = codec
+        self.level = DEFAULT_LEVELS.get(codec, 0) if level is None else level
+        self.shuffle = shuffle and codec != "none"
+        if codec != "none":
+            self._compress, self._decompress = _compressors(codec)
+
+    @property
+    def name(self) -> str:
+        """Codec and byte shuffling, all a decoder needs, e.g. lz4-shuffle"""
+        return f"{self.codec}-shuffle" if self.shuffle else self.codec
+
+    def encode(self, points: np.ndarray) -> bytes:
+        """Compressed bytes of a structured points array"""
+
+        if self.codec == "none":
+            return points.tobytes()
+        data = byte_shuffle(points) if self.shuffle else np.ascontiguousarray(points)
+        return self._compress(data.data, self.level)
+
+    def decode(self, data: bytes, dtype: np.dtype) -> np.ndarray:
+        """Points of ``dtype`` from bytes produced by ``encode``"""
+
+        if self.codec != "none":
+            data = self._decompress(data)
+        if not self.shuffle:
+            return np.frombuffer(data, dtype).copy()
+        planes = np.frombuffer(data, np.uint8).reshape(dtype.itemsize, -1)
+        return byte_unshuffle(planes, dtype)
+
+    def description(self, points: np.ndarray) -> Dict[str, Any]:
+        """How the data of an encoded payload was encoded, attached to the sample so
+        subscribers can detect and reverse it"""
+
+        return {
+            "codec": self.codec,
+            "level": self.level,
+            "shuffle": self.shuffle,
+            "points": len(points),
+            "point_stride": points.dtype.itemsize,
+        }
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+Timestamp-paced replay of recorded packet sources, such as pcap files, in process or
+as UDP datagrams to a connector listening like it would for a sensor
+"""
+
+import sys
+import time
+import socket
+import logging
+import argparse
+from typing import Iterator, Optional, Tuple
+
+from pcap_index import open_pcap
+from ouster.sdk.client import ImuPacket, Packet, PacketSource, SensorInfo
+
+# Falling further behind the recorded timeline than this (a consumer slower than the
+# replay rate) restarts the pacing clock instead of bursting to catch up
+MAX_LAG_S = 1.0
+
+
+class PacedPacketSource:
+    """Packet source yielding the packets of another (recorded) source paced by their
+    capture timestamps, ``rate`` times faster than they were recorded.
+
+    A ``rate`` of 0 replays the packets as fast as they are consumed. A capture
+    timestamp jumping back in time, as happens when the wrapped source loops,
+    restarts the pacing clock so that every pass is replayed at the same rate."""
+
+    def __init__(self, source: PacketSource, rate: float = 1.0):
+        self._source = source
+        self._rate = max(0.0, rate)
+
+    @property
+    def metadata(self) -> SensorInfo:
+        """Metadata of the wrapped packet source"""
+        return self._source.metadata
+
+    @property
+    def is_live(self) -> bool:
+        """A replay is never live"""
+        return False
+
+    def close(self):
+        """Close the wrapped packet source"""
+        self._source.close()
+
+    def __iter__(self) -> Iterator[Packet]:
+        wall_start = 0.0
+        capture_start: Optional[float] = None
+        capture_last = 0.0
+
+        for packet in self._source:
+            if self._rate:
+                capture = packet.capture_timestamp
+                now = time.monotonic()
+
+                if capture_start is None or capture < capture_last:
+                    wall_start, capture_start = now, capture
+
+                ahead = (capture - capture_start) / self._rate - (now - wall_start)
+                if ahead > 0:
+                    time.sleep(ahead)
+                elif ahead < -MAX_LAG_S:
+                    wall_start, capture_start = now, capture
+
+                capture_last = capture
+
+            yield packet
+
+
+def replay_udp(
+    source: PacketSource,
+    lidar_address: Tuple[str, int],
+    imu_address: Tuple[str, int],
+    rate: float = 1.0,
+) -> int:
+    """Send the packets of a recorded source, paced as with PacedPacketSource, as UDP
+    datagrams to the lidar and IMU ports of a receiver. Returns the number sent."""
+
+    sent = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for packet in PacedPacketSource(source, rate):
+            address = imu_address if isinstance(packet, ImuPacket) else lidar_address
+            sock.sendto(packet._data, address)
+            sent += 1
+    return sent
+
+
+def run():
+    """Replay a pcap file over UDP, e.g. to the from_udp subcommand of the connector"""
+
+    parser = argparse.ArgumentParser(
+        prog="replay",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-p", "--pcap-file", type=str, required=True)
+    parser.add_argument("-m", "--metadata-file", type=str, required=True)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--lidar-port", type=int, default=7502)
+    parser.add_argument("--imu-port", type=int, default=7503)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to the recorded packet timestamps, 0 = as fast "
+        "as possible",
+    )
+    parser.add_argument("--loop", action="store_true")
+    parser.add_argument(
+        "--start",
+        type=float,
+        default=None,
+        help="Seconds after the first frame to start the replay at",
+    )
+    parser.add_argument(
+        "--end",
+        type=float,
+        default=None,
+        help="Seconds after the first frame to end the replay at",
+    )
+    parser.add_argument("--log-level", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s", level=args.log_level
+    )
+
+    with open(args.metadata_file, "r") as f:
+        metadata = SensorInfo(f.read())
+
+    source = open_pcap(
+        args.pcap_file, metadata, start=args.start, end=args.end, loop=args.loop
+    )
+    try:
+        start = time.monotonic()
+        sent = replay_udp(
+            source,
+            (args.host, args.lidar_port),
+            (args.host, args.imu_port),
+            args.rate,
+        )
+        logging.info(
+            "Sent %d packets in %.2f s to %s", sent, time.monotonic() - start, args.host
+        )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,115 @@
+"""
+Bounded pool of reusable LidarScan buffers, handed out to the scan batcher and shared
+by the processing stages through reference counts
+"""
+
+import logging
+import threading
+from typing import Callable, Dict, List
+
+from ouster.sdk.client import LidarScan
+
+POOL_POLICIES = ("block", "allocate")
+
+# Longest a "block" acquire waits for a scan to be released before allocating one
+# anyway, so a scan that is never released cannot stall ingestion for good
+BLOCK_TIMEOUT_S = 1.0
+
+
+class ScanPool:
+    """Up to ``size`` preallocated LidarScans, recycled once every holder has released
+    them. The ScanBatcher zeroes the columns it did not receive in every frame it
+    writes, so a recycled scan needs no clearing.
+
+    ``acquire`` hands out a free scan with one reference. Stages keeping a scan after
+    handing it on take a reference of their own with ``retain``, and every reference
+    is given back with ``release``; the scan returns to the pool with the last one.
+
+    When all scans are in use the "block" policy makes ``acquire`` wait for a release
+    (back-pressure on ingestion, the socket buffers absorb the packets meanwhile), the
+    "allocate" policy allocates a scan beyond the pool, dropped once released. Both
+    are counted in ``exhausted``. A size of 0 disables pooling."""
+
+    def __init__(
+        self,
+        new_scan: Callable[[], LidarScan],
+        size: int = 8,
+        policy: str = "block",
+    ):
+        if policy not in POOL_POLICIES:
+            raise ValueError(f"Unknown scan pool policy: {policy}")
+
+        self._new_scan = new_scan
+        self.size = max(0, size)
+        self._policy = policy
+
+        # References by id of the scans out of the pool, the pooled ones own theirs
+        self._refs: Dict[int, int] = {}
+        self._pooled: Dict[int, LidarScan] = {}
+        self._free: List[LidarScan] = []
+        self._cond = threading.Condition()
+
+        self.allocated = 0
+        self.exhausted = 0
+
+    def _allocate(self, pooled: bool) -> LidarScan:
+        # Called with the lock held
+        scan = self._new_scan()
+        self.allocated += 1
+        if pooled:
+            self._pooled[id(scan)] = scan
+        return scan
+
+    def acquire(self) -> LidarScan:
+        """A free scan, with one reference held by the caller"""
+
+        with self._cond:
+            if not self._free and len(self._pooled) < self.size:
+                scan = self._allocate(pooled=True)
+            else:
+                if not self._free and self.size:
+                    self.exhausted += 1
+                    if self._policy == "block":
+                        if not self._cond.wait_for(lambda: self._free, BLOCK_TIMEOUT_S):
+                            logging.warning(
+                                "No scan released within %ss, %d of %d in use",
+                                BLOCK_TIMEOUT_S,
+                                len(self._refs),
+                                self.size,
+                            )
+                scan = self._free.pop() if self._free else self._allocate(False)
+            self._refs[id(scan)] = 1
+            return scan
+
+    def retain(self, scan: LidarScan):
+        """Take another reference to an acquired scan"""
+
+        with self._cond:
+            self._refs[id(scan)] += 1
+
+    def release(self, scan: LidarScan):
+        """Give back a reference, the scan is recycled with the last one"""
+
+        with self._cond:
+            refs = self._refs[id(scan)] - 1
+            if refs:
+                self._refs[id(scan)] = refs
+                return
+
+            del self._refs[id(scan)]
+            if id(scan) in self._pooled:
+                self._free.append(scan)
+                self._cond.notify()
+
+    @property
+    def in_use(self) -> int:
+        """Scans currently held"""
+        return len(self._refs)
+
+    def stats(self):
+        """Pool counters for the metrics"""
+        return {
+            "scan_pool_in_use": self.in_use,
+            "scan_pool_allocated": self.allocated,
+            "scan_pool_exhausted": self.exhausted,
+        }
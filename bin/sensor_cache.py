@@ -0,0 +1,159 @@
+"""
+Local cache of the metadata and XYZ lookup table of sensors, by serial number and
+configuration, so a restart neither waits for the metadata of the sensor nor computes
+the lookup table again
+"""
+
+import os
+import json
+import hashlib
+import logging
+import urllib.request
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from ouster.sdk import client
+
+from projection import set_xyz_lut_planes, xyz_lut_planes
+
+# HTTP API of the sensor: serial number, firmware, initialization id and status
+SENSOR_INFO_URL = "http://{hostname}/api/v1/sensor/metadata/sensor_info"
+
+# Default cache directory, kept across container restarts when mounted
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "keelson-connector-lidar-os",
+)
+
+# Configuration parameters a requested SensorConfig may set, compared against the
+# active configuration before reconfiguring the sensor
+CONFIG_PARAMETERS = (
+    "lidar_mode",
+    "azimuth_window",
+    "operating_mode",
+    "udp_dest",
+    "udp_port_lidar",
+    "udp_port_imu",
+)
+
+
+def fetch_sensor_info(hostname: str, timeout: float = 5.0) -> Dict[str, Any]:
+    """The sensor_info of the HTTP API of the sensor, a quick request unlike the full
+    metadata"""
+
+    url = SENSOR_INFO_URL.format(hostname=hostname)
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+
+def config_changes(
+    requested: client.SensorConfig, active: client.SensorConfig
+) -> Dict[str, Tuple[Any, Any]]:
+    """The parameters set in ``requested`` that differ from the ``active``
+    configuration of the sensor, as (active, requested) by name"""
+
+    changes = {}
+    for name in CONFIG_PARAMETERS:
+        wanted = getattr(requested, name)
+        if wanted is not None and wanted != getattr(active, name):
+            changes[name] = (getattr(active, name), wanted)
+    return changes
+
+
+def config_key(config: client.SensorConfig, firmware: str) -> str:
+    """Short hash of the active configuration and firmware of a sensor, which
+    the metadata and lookup table follow from"""
+
+    return hashlib.sha256(f"{firmware}\n{config}".encode()).hexdigest()[:12]
+
+
+class SensorCache:
+    """Metadata and lookup tables of sensors in ``directory``, as
+    os-<serial>-<config key>.json (the metadata, as in os-992109000253.local.json)
+    and os-<serial>-<config key>.lut.npz.
+
+    The cache is only used while the sensor reports itself running, its
+    initialization id (which changes when the sensor restarts or is reconfigured) is
+    taken over from the sensor. Anything else, or a cache that cannot be read or
+    written, falls back to fetching the metadata from the sensor."""
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR):
+        self.directory = directory
+
+    def _paths(self, serial: str, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, f"os-{serial}-{key}")
+        return base + ".json", base + ".lut.npz"
+
+    def metadata(
+        self,
+        hostname: str,
+        config: client.SensorConfig,
+        fetch: Callable[[str], client.SensorInfo],
+    ) -> client.SensorInfo:
+        """Metadata of the sensor at ``hostname``, in its active ``config``: from the
+        cache, or from ``fetch(hostname)`` and then cached. The lookup table is made
+        available to xyz_lut_planes the same way."""
+
+        try:
+            sensor_info = fetch_sensor_info(hostname)
+            serial = str(sensor_info["prod_sn"])
+            key = config_key(config, sensor_info.get("build_rev", ""))
+            init_id = int(sensor_info["initialization_id"])
+            running = sensor_info.get("status") == "RUNNING"
+        except (OSError, ValueError, KeyError) as error:
+            logging.warning("No sensor info from %s, not caching: %s", hostname, error)
+            return fetch(hostname)
+
+        metadata_path, lut_path = self._paths(serial, key)
+        metadata = (
+            self._load(metadata_path, lut_path, serial, init_id) if running else None
+        )
+        if metadata is not None:
+            logging.info("Read metadata of %s from %s", hostname, metadata_path)
+            return metadata
+
+        metadata = fetch(hostname)
+        self._store(metadata, metadata_path, lut_path)
+        return metadata
+
+    def _load(
+        self,
+        metadata_path: str,
+        lut_path: str,
+        serial: str,
+        init_id: int,
+    ) -> Optional[client.SensorInfo]:
+        try:
+            with open(metadata_path, "r") as f:
+                metadata = client.SensorInfo(f.read())
+            with np.load(lut_path) as lut:
+                planes = (lut["direction"], lut["offset"])
+        except (OSError, KeyError, ValueError) as error:
+            logging.info("No cached metadata at %s: %s", metadata_path, error)
+            return None
+
+        if str(metadata.sn) != serial:
+            logging.warning("Cached metadata %s is not of %s", metadata_path, serial)
+            return None
+        # The live initialization id, set first as the lookup table is registered by
+        # metadata
+        metadata.init_id = init_id
+        set_xyz_lut_planes(metadata, planes)
+        return metadata
+
+    def _store(self, metadata: client.SensorInfo, metadata_path: str, lut_path: str):
+        direction, offset = xyz_lut_planes(metadata)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Written aside and moved in place, a concurrent start never reads half
+            with open(lut_path + ".tmp", "wb") as f:
+                np.savez(f, direction=direction, offset=offset)
+            os.replace(lut_path + ".tmp", lut_path)
+            with open(metadata_path + ".tmp", "w") as f:
+                f.write(metadata.updated_metadata_string())
+            os.replace(metadata_path + ".tmp", metadata_path)
+            logging.info("Cached the metadata and lookup table at %s", metadata_path)
+        except OSError as error:
+            logging.warning(
+                "Could not cache the metadata at %s: %s", metadata_path, error
+            )
@@ -0,0 +1,201 @@
+"""
+Single-pass protobuf serialization of the published messages: the constant fields of
+a message (fields, pose, frame id, ...) are encoded once, and every message is the
+keelson envelope header, its timestamp and its data written out in one go, without
+building and serializing a message, then an envelope, around the data
+"""
+
+import time
+import struct
+import functools
+from typing import List, Optional, Sequence, Union
+
+from google.protobuf.message import Message
+from keelson.Envelope_pb2 import Envelope
+
+# Protobuf wire types
+WIRE_TYPE_VARINT = 0
+WIRE_TYPE_I64 = 1
+WIRE_TYPE_LEN = 2
+
+# Field numbers of google.protobuf.Timestamp
+TIMESTAMP_SECONDS = 1
+TIMESTAMP_NANOS = 2
+
+# Varints of a single byte (tags, short lengths), looked up rather than encoded
+SMALL_VARINTS = tuple(bytes((value,)) for value in range(0x80))
+
+# A double of value 0, left out of serialized messages
+ZERO_DOUBLE = struct.pack("<d", 0.0)
+
+# The x, y and z fields of a foxglove.Vector3, when none is 0
+VECTOR3 = struct.Struct("<BdBdBd")
+
+# Anything exposing the buffer protocol: bytes, memoryviews of numpy arrays, ...
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def varint(value: int) -> bytes:
+    """Base 128 varint encoding of a non-negative integer"""
+
+    if value < 0x80:
+        return SMALL_VARINTS[value]
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def length_delimited_header(field_number: int, length: int) -> bytes:
+    """Tag and length of a bytes or embedded message field of ``length`` bytes"""
+    return varint(field_number << 3 | WIRE_TYPE_LEN) + varint(length)
+
+
+@functools.lru_cache(maxsize=4)
+def _seconds_field(seconds: int) -> bytes:
+    # The seconds of a Timestamp, the same for a second of messages
+    if not seconds:
+        return b""
+    return varint(TIMESTAMP_SECONDS << 3 | WIRE_TYPE_VARINT) + varint(seconds)
+
+
+def encode_timestamp(field_number: int, timestamp_ns: int) -> bytes:
+    """A google.protobuf.Timestamp field, as Timestamp.FromNanoseconds sets it"""
+
+    seconds, nanos = divmod(timestamp_ns, 1_000_000_000)
+    body = _seconds_field(seconds)
+    if nanos:
+        body += varint(TIMESTAMP_NANOS << 3 | WIRE_TYPE_VARINT) + varint(nanos)
+    return length_delimited_header(field_number, len(body)) + body
+
+
+def encode_doubles(*values: float) -> bytes:
+    """A message of double fields numbered 1, 2, ... (such as foxglove.Vector3), as
+    SerializeToString writes it: fields of value 0 left out"""
+
+    body = b""
+    for number, value in enumerate(values, 1):
+        packed = struct.pack("<d", value)
+        if packed != ZERO_DOUBLE:
+            body += varint(number << 3 | WIRE_TYPE_I64) + packed
+    return body
+
+
+def encode_vector3(x: float, y: float, z: float) -> bytes:
+    """A foxglove.Vector3 message, as SerializeToString writes it"""
+
+    if x and y and z:
+        return VECTOR3.pack(
+            1 << 3 | WIRE_TYPE_I64,
+            x,
+            2 << 3 | WIRE_TYPE_I64,
+            y,
+            3 << 3 | WIRE_TYPE_I64,
+            z,
+        )
+    return encode_doubles(x, y, z)
+
+
+def envelope_header(payload_size: int, enclosed_at: Optional[int] = None) -> bytes:
+    """The bytes of a keelson envelope preceding a payload of ``payload_size``"""
+
+    return encode_timestamp(
+        Envelope.ENCLOSED_AT_FIELD_NUMBER, enclosed_at or time.time_ns()
+    ) + length_delimited_header(Envelope.PAYLOAD_FIELD_NUMBER, payload_size)
+
+
+def enclose(payload: bytes, enclosed_at: Optional[int] = None) -> bytes:
+    """keelson.enclose without building an envelope message, the same bytes"""
+    return envelope_header(len(payload), enclosed_at) + payload
+
+
+class MessageTemplate:
+    """A protobuf message whose fields but a timestamp and a bytes data field are the
+    same from message to message, such as the foxglove point clouds of one sensor.
+    The constant fields are serialized once, on creation. The timestamp and data of
+    ``message`` are ignored. The data field may as well be an embedded message,
+    given serialized as data.
+
+    The messages are written in field number order, the bytes of the message
+    serialized with SerializeToString and enclosed with keelson.enclose."""
+
+    def __init__(
+        self,
+        message: Message,
+        data_field: str = "data",
+        timestamp_field: str = "timestamp",
+    ):
+        fields = message.DESCRIPTOR.fields_by_name
+        self._data_number = fields[data_field].number
+        self._timestamp_number = fields[timestamp_field].number
+
+        # The constant fields before and after the data, by field number
+        before, after = type(message)(), type(message)()
+        before.CopyFrom(message)
+        after.CopyFrom(message)
+        for template in (before, after):
+            template.ClearField(data_field)
+            template.ClearField(timestamp_field)
+        for field, _ in message.ListFields():
+            if field.number < self._data_number:
+                after.ClearField(field.name)
+            else:
+                before.ClearField(field.name)
+        self._before = before.SerializeToString()
+        self._after = after.SerializeToString()
+
+    def message_parts(self, timestamp_ns: int, data: Buffer) -> List[Buffer]:
+        """The serialized message as consecutive parts, ``data`` as is among them"""
+
+        timestamp = encode_timestamp(self._timestamp_number, timestamp_ns)
+        data_header = length_delimited_header(self._data_number, len(data))
+        if self._timestamp_number < self._data_number:
+            return [timestamp + self._before + data_header, data, self._after]
+        return [self._before + data_header, data, timestamp + self._after]
+
+    def enclosed_parts(
+        self, timestamp_ns: int, data: Buffer, enclosed_at: Optional[int] = None
+    ) -> List[Buffer]:
+        """The enclosed message as consecutive parts, ``data`` as is among them"""
+
+        parts = self.message_parts(timestamp_ns, data)
+        size = sum(len(part) for part in parts)
+        parts[0] = envelope_header(size, enclosed_at) + parts[0]
+        return parts
+
+    def enclose(
+        self, timestamp_ns: int, data: Buffer, enclosed_at: Optional[int] = None
+    ) -> bytes:
+        """The enclosed message, written out in one pass: the only copy of
+        ``data`` made"""
+
+        return b"".join(self.enclosed_parts(timestamp_ns, data, enclosed_at))
+
+    def enclose_all(
+        self,
+        timestamp_ns: int,
+        datas: Sequence[bytes],
+        enclosed_at: Optional[int] = None,
+    ) -> List[bytes]:
+        """The enclosed messages of several (small) data of the same timestamp, such
+        as the vectors of an IMU sample, the timestamps encoded once for all"""
+
+        timestamp = encode_timestamp(self._timestamp_number, timestamp_ns)
+        enclosed_at_field = encode_timestamp(
+            Envelope.ENCLOSED_AT_FIELD_NUMBER, enclosed_at or time.time_ns()
+        )
+        envelopes = []
+        for data in datas:
+            data_header = length_delimited_header(self._data_number, len(data))
+            if self._timestamp_number < self._data_number:
+                message = timestamp + self._before + data_header + data + self._after
+            else:
+                message = self._before + data_header + data + timestamp + self._after
+            envelopes.append(
+                enclosed_at_field
+                + length_delimited_header(Envelope.PAYLOAD_FIELD_NUMBER, len(message))
+                + message
+            )
+        return envelopes
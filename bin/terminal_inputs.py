@@ -1,5 +1,62 @@
+import os
 import argparse
-from main import from_sensor, from_pcap
+from typing import List
+
+from main import from_sensor, from_udp, from_pcap
+from projection import POINT_CHANNELS
+from raw_codec import RAW_CODECS
+from convert import to_mcap
+from sensor_cache import DEFAULT_CACHE_DIR
+
+# Channels that can be published with --fields, those the projector can carry
+CHANNELS = list(POINT_CHANNELS)
+
+
+def channel_list(value: str) -> List[str]:
+    """Parse a comma separated list of --fields channels"""
+
+    if value == "none":
+        return []
+    channels = [channel.strip() for channel in value.split(",") if channel.strip()]
+    unknown = [channel for channel in channels if channel not in CHANNELS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown channel(s) {', '.join(unknown)}, choose from {', '.join(CHANNELS)}"
+        )
+    return channels
+
+
+def level_list(value: str) -> List[int]:
+    """Parse a comma separated list of --lod decimations"""
+
+    try:
+        levels = [int(level) for level in value.split(",") if level.strip()]
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"not a list of integers: {value}") from error
+    if not levels or min(levels) < 1 or len(set(levels)) != len(levels):
+        raise argparse.ArgumentTypeError(
+            f"levels must be distinct integers of at least 1, got {value}"
+        )
+    return sorted(levels)
+
+
+def add_time_range_arguments(parser: argparse.ArgumentParser):
+    """--start/--end selection of the frames of a pcap file"""
+
+    parser.add_argument(
+        "--start",
+        type=float,
+        default=None,
+        help="Skip to the frames captured this many seconds after the first one, "
+        "looked up in the frame index of the pcap file (built once and cached "
+        "next to it as <pcap-file>.index.npz)",
+    )
+    parser.add_argument(
+        "--end",
+        type=float,
+        default=None,
+        help="Stop after the frames captured this many seconds after the first one",
+    )
 
 
 def terminal_inputs():
@@ -56,9 +113,137 @@ def terminal_inputs():
         "--point-cloud-format",
         type=str,
         default="both",
-        choices=["raw", "compressed", "both"],
+        choices=["raw", "compressed", "both", "none"],
         help="Which point cloud topics to publish: raw (foxglove.PointCloud), "
-        "compressed (Draco foxglove.CompressedPointCloud), or both",
+        "compressed (Draco foxglove.CompressedPointCloud), both, or none (e.g. "
+        "with --range-image only)",
+    )
+
+    parser.add_argument(
+        "--eager-encoding",
+        action="store_true",
+        help="Project and encode the point cloud topics every frame even when no "
+        "subscriber matches them. By default a topic is skipped while nobody "
+        "is subscribed and resumes with the next frame once someone is",
+    )
+
+    parser.add_argument(
+        "--sector-packets",
+        type=int,
+        default=0,
+        help="Project and publish the point cloud topics per azimuth sector of this "
+        "many column packets as soon as it is received, instead of per frame, to "
+        "cut the age of the points. The sector bounds and timestamps are attached "
+        "to every sample as JSON. 0 = whole frames",
+    )
+
+    parser.add_argument(
+        "--range-image",
+        action="store_true",
+        help="Also publish the destaggered range/signal/reflectivity/near_ir "
+        "channels as 16-bit PNG foxglove.CompressedImage (image_compressed, "
+        "source id suffixed with the channel) and the metadata/LUT needed to "
+        "rebuild XYZ (configuration_json, source id suffixed with /range_image)",
+    )
+
+    parser.add_argument(
+        "--range-image-resolution",
+        type=int,
+        default=8,
+        help="Range unit of the range image in millimetres, 16 bits cover "
+        "65535 times this range",
+    )
+
+    parser.add_argument(
+        "--range-image-level",
+        type=int,
+        default=1,
+        choices=range(10),
+        metavar="{0..9}",
+        help="zlib compression level of the range image PNGs "
+        "(1 = fastest, 9 = smallest)",
+    )
+
+    parser.add_argument(
+        "--point-layout",
+        type=str,
+        default="float64",
+        choices=["float64", "packed"],
+        help="Point layout of the RAW point cloud topic: float64 for every field "
+        "(48 bytes/point) or packed float32 x/y/z with uint16 "
+        "signal/reflectivity/near_ir (18 bytes/point)",
+    )
+
+    parser.add_argument(
+        "--raw-codec",
+        type=str,
+        default="none",
+        choices=RAW_CODECS,
+        help="Lossless compression of the data of the RAW point cloud topic. The "
+        "codec is attached to every sample as JSON under 'encoding', subscribers "
+        "need to decompress (and unshuffle) the data before reading the points",
+    )
+
+    parser.add_argument(
+        "--raw-codec-level",
+        type=int,
+        default=None,
+        help="Compression level of --raw-codec, a fast one by default",
+    )
+
+    parser.add_argument(
+        "--no-raw-shuffle",
+        action="store_true",
+        help="Compress the point records as is instead of byte shuffling them "
+        "(every byte of a point in its own plane) first",
+    )
+
+    parser.add_argument(
+        "--shm",
+        action="store_true",
+        help="Publish the point cloud topics through zenoh shared memory: "
+        "subscribers on the same host map the samples instead of receiving a copy, "
+        "remote subscribers are served as before",
+    )
+
+    parser.add_argument(
+        "--shm-size",
+        type=int,
+        default=64,
+        help="Size of the --shm pool in MiB, samples that do not fit are published "
+        "without shared memory",
+    )
+
+    parser.add_argument(
+        "--fields",
+        type=channel_list,
+        default=CHANNELS,
+        metavar="CHANNEL[,CHANNEL...]",
+        help="Comma separated channels batched from the packets and published "
+        f"along with x/y/z (point clouds) or range (range images), out of "
+        f"{','.join(CHANNELS)}, or 'none' for none",
+    )
+
+    parser.add_argument(
+        "--drop-invalid",
+        action="store_true",
+        help="Drop points without a return (range 0) instead of publishing them "
+        "at the sensor origin",
+    )
+
+    parser.add_argument(
+        "--min-range",
+        type=float,
+        default=0.0,
+        help="Drop points closer than this range in meters (also drops points "
+        "without a return when > 0)",
+    )
+
+    parser.add_argument(
+        "--max-range",
+        type=float,
+        default=None,
+        help="Drop points further away than this range in meters",
     )
 
     parser.add_argument(
@@ -69,20 +254,223 @@ def terminal_inputs():
         "(the raw topic stays full resolution). 1 = no decimation",
     )
 
+    parser.add_argument(
+        "--reduction",
+        type=str,
+        default="stride",
+        choices=["stride", "voxel"],
+        help="How --decimate thins out the COMPRESSED point cloud topic: keep every "
+        "Nth point (stride) or one point per occupied voxel of --voxel-size times "
+        "the decimation (voxel)",
+    )
+
+    parser.add_argument(
+        "--voxel-size",
+        type=float,
+        default=0.1,
+        help="Voxel leaf size in meters for --reduction voxel",
+    )
+
+    parser.add_argument(
+        "--voxel-mode",
+        type=str,
+        default="centroid",
+        choices=["centroid", "first"],
+        help="Point kept per voxel for --reduction voxel: the centroid of its points "
+        "or the first of them",
+    )
+
+    parser.add_argument(
+        "--lod",
+        type=level_list,
+        default=None,
+        help="Publish the COMPRESSED point cloud topic at several levels of detail, "
+        "each under <source-id>/lod<N> and decimated N times more than --decimate, "
+        "e.g. 1,4,16. All levels are reduced from one projection, voxel levels "
+        "sharing the binning of the points",
+    )
+
+    parser.add_argument(
+        "--quantization-bits",
+        type=int,
+        default=14,
+        help="Draco quantization bits of the point positions in the COMPRESSED "
+        "point cloud topic",
+    )
+
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=7,
+        choices=range(11),
+        metavar="{0..10}",
+        help="Draco compression level of the COMPRESSED point cloud topic "
+        "(0 = fastest, 10 = smallest)",
+    )
+
+    parser.add_argument(
+        "--adaptive-compression",
+        action="store_true",
+        help="Tune decimation, quantization bits and compression level of the "
+        "COMPRESSED topic at runtime, starting from --decimate, --quantization-bits "
+        "and --compression-level, to keep the encode time within --encode-budget "
+        "and the output below --target-bitrate",
+    )
+
+    parser.add_argument(
+        "--encode-budget",
+        type=float,
+        default=0.8,
+        help="Adaptive compression: share of the frame period (of the lidar mode) "
+        "the Draco encode of a frame may take, per encode worker",
+    )
+
+    parser.add_argument(
+        "--target-bitrate",
+        type=float,
+        default=None,
+        help="Adaptive compression: max bitrate of the COMPRESSED topic in Mbit/s",
+    )
+
+    parser.add_argument(
+        "--max-decimate",
+        type=int,
+        default=8,
+        help="Adaptive compression: upper bound of the decimation",
+    )
+
+    parser.add_argument(
+        "--min-quantization-bits",
+        type=int,
+        default=10,
+        help="Adaptive compression: lower bound of the quantization bits",
+    )
+
+    parser.add_argument(
+        "--encode-workers",
+        type=int,
+        default=0,
+        help="Number of workers Draco-encoding the COMPRESSED point cloud topic in "
+        "parallel (frames are still published in order). 0 = encode inline",
+    )
+
+    parser.add_argument(
+        "--encode-backend",
+        type=str,
+        default="process",
+        choices=["process", "thread"],
+        help="Worker type used when --encode-workers > 0",
+    )
+
+    parser.add_argument(
+        "--scan-pool",
+        type=int,
+        default=None,
+        help="Number of preallocated LidarScans reused for the incoming frames "
+        "(they return to the pool once published or dropped), by default enough to "
+        "fill the pipeline queues (2 x --queue-size + 4). 0 = allocate a new scan "
+        "per frame",
+    )
+
+    parser.add_argument(
+        "--scan-pool-policy",
+        type=str,
+        default="block",
+        choices=["block", "allocate"],
+        help="What to do when all pooled scans are in use: block ingestion until "
+        "one is released (the socket buffers absorb the packets meanwhile) or "
+        "allocate a temporary scan",
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10.0,
+        help="Seconds between metrics reports (stage timings, latencies, counters) "
+        "published on the connector_metrics subject. 0 = only at exit",
+    )
+
+    parser.add_argument(
+        "--imu-latency-budget",
+        type=float,
+        default=5.0,
+        help="IMU samples taking longer than this (ms) from being read to being "
+        "published are counted as late (imu_late) in the metrics",
+    )
+
     ## Subcommands
     subparsers = parser.add_subparsers(required=True)
 
+    ## Options of the live subcommands (from_sensor, from_udp)
+    live_parser = argparse.ArgumentParser(add_help=False)
+
+    live_parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="Max number of scans waiting in front of each pipeline stage "
+        "(projection, encode/publish)",
+    )
+
+    live_parser.add_argument(
+        "--queue-policy",
+        type=str,
+        default="drop-oldest",
+        choices=["drop-oldest", "block"],
+        help="What to do when a pipeline queue is full: drop the oldest waiting scan "
+        "(ingestion never blocks) or block ingestion until there is room",
+    )
+
+    live_parser.add_argument(
+        "--udp-host",
+        type=str,
+        default="",
+        help="Address the native UDP source listens on, all by default",
+    )
+
+    live_parser.add_argument(
+        "--udp-recv-buffer",
+        type=float,
+        default=32,
+        help="Kernel receive buffer of the native UDP source sockets in MiB "
+        "(capped by net.core.rmem_max unless running with CAP_NET_ADMIN)",
+    )
+
+    live_parser.add_argument(
+        "--udp-ring-packets",
+        type=int,
+        default=1024,
+        help="Lidar packets the native UDP source can hold while the connector "
+        "is busy, further packets are dropped",
+    )
+
     ## from_sensor subcommand
-    from_sensor_parser = subparsers.add_parser("from_sensor")
+    from_sensor_parser = subparsers.add_parser(
+        "from_sensor",
+        parents=[live_parser],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
 
     from_sensor_parser.add_argument(
         "-o",
         "--ouster-hostname",
         type=str,
-        help='Sensor hostname, e.g. "os-122033000087"',
+        action="append",
+        help='Sensor hostname, e.g. "os-122033000087", optionally followed by the '
+        'source id to publish it under, e.g. "os-122033000087=lidar/os2/1". Repeat '
+        "to run several sensors from this process, sensors without a source id "
+        "then publish under --source-id/<index>. Several sensors are configured "
+        "to stream to this host on UDP ports 7502/7503, 7504/7505 and so on",
         required=True,
     )
 
+    from_sensor_parser.add_argument(
+        "--pin-cores",
+        action="store_true",
+        help="Split the available cores between the sensors and pin the threads of "
+        "every sensor to its share",
+    )
+
     from_sensor_parser.add_argument(
         "--view-angle-deg-start",
         type=int,
@@ -108,14 +496,97 @@ def terminal_inputs():
         help="Lidar mode scan (columns(x)frequency)",
     )
 
+    from_sensor_parser.add_argument(
+        "--udp-source",
+        type=str,
+        default="sdk",
+        choices=["sdk", "native"],
+        help="Receive the UDP packets with the ouster-sdk client or natively, "
+        "with batched reads into a packet ring and enlarged socket buffers "
+        "(reports kernel and userspace drops in the metrics)",
+    )
+
+    from_sensor_parser.add_argument(
+        "--sensor-cache",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Directory caching the metadata and XYZ lookup table of every sensor, "
+        "by serial number and configuration, so restarts skip fetching them",
+    )
+
+    from_sensor_parser.add_argument(
+        "--no-sensor-cache",
+        action="store_true",
+        help="Always fetch the metadata from the sensor",
+    )
+
     from_sensor_parser.set_defaults(func=from_sensor)
 
+    ## from_udp subcommand
+    from_udp_parser = subparsers.add_parser(
+        "from_udp",
+        parents=[live_parser],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Receive the packets of a sensor configured elsewhere, or of a UDP "
+        "replay (bin/replay.py), with the native UDP source",
+    )
+    from_udp_parser.add_argument("-m", "--metadata-file", type=str, required=True)
+    from_udp_parser.add_argument("--lidar-port", type=int, default=7502)
+    from_udp_parser.add_argument("--imu-port", type=int, default=7503)
+    from_udp_parser.set_defaults(func=from_udp)
+
     ## from_pcap subcommand
     from_pcap_parser = subparsers.add_parser("from_pcap")
     from_pcap_parser.add_argument("-p", "--pcap-file", type=str, required=True)
     from_pcap_parser.add_argument("-m", "--metadata-file", type=str, required=True)
+
+    from_pcap_parser.add_argument(
+        "--rate",
+        type=float,
+        default=1.0,
+        help="Replay speed relative to the recorded packet timestamps, "
+        "e.g. 0.5, 1 (real-time) or 4",
+    )
+
+    from_pcap_parser.add_argument(
+        "--loop",
+        action="store_true",
+        help="Restart from the beginning of the pcap file when reaching its end",
+    )
+
+    from_pcap_parser.add_argument(
+        "--max-throughput",
+        action="store_true",
+        help="Replay as fast as possible, ignoring --rate, and report the achieved "
+        "frames/s (measures the ceiling of the connector itself)",
+    )
+
+    add_time_range_arguments(from_pcap_parser)
+
     from_pcap_parser.set_defaults(func=from_pcap)
 
+    ## to_mcap subcommand
+    to_mcap_parser = subparsers.add_parser(
+        "to_mcap",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help="Convert a pcap file to an MCAP file offline, without zenoh, with the "
+        "point cloud and IMU messages on the topics they would be published on",
+    )
+    to_mcap_parser.add_argument("-p", "--pcap-file", type=str, required=True)
+    to_mcap_parser.add_argument("-m", "--metadata-file", type=str, required=True)
+    to_mcap_parser.add_argument(
+        "-o", "--output", type=str, required=True, help="MCAP file to write"
+    )
+    to_mcap_parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Worker processes projecting and encoding the frames (written in "
+        "recording order). 0 = convert inline",
+    )
+    add_time_range_arguments(to_mcap_parser)
+    to_mcap_parser.set_defaults(func=to_mcap, offline=True)
+
     ## Parse arguments and start doing our thing
     args = parser.parse_args()
 
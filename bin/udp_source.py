@@ -0,0 +1,245 @@
+"""
+Native UDP ingest of lidar and IMU packets: batched non-blocking receives on sockets
+with enlarged kernel buffers, into a ring of preallocated packets
+"""
+
+import os
+import time
+import socket
+import select
+import logging
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Union
+
+from ouster.sdk.client import ClientTimeout, ImuPacket, LidarPacket, SensorInfo
+from ouster.sdk.client import _client
+
+# Kernel receive buffer asked for per socket, the kernel caps it at net.core.rmem_max
+# unless the process may force it (CAP_NET_ADMIN)
+DEFAULT_RECV_BUFFER_BYTES = 32 * 2**20
+
+# Most packets read from one socket per wake-up before handing them over
+DEFAULT_BATCH = 64
+
+# Time the receiver waits for a socket to become readable before checking for close
+POLL_INTERVAL_S = 0.1
+
+# SO_RCVBUFFORCE is Linux only and not exposed by every Python build
+SO_RCVBUFFORCE = getattr(socket, "SO_RCVBUFFORCE", 33)
+
+Packet = Union[LidarPacket, ImuPacket]
+
+
+def open_udp_socket(host: str, port: int, recv_buffer_bytes: int) -> socket.socket:
+    """Non-blocking UDP socket bound to (host, port) with a kernel receive buffer of
+    (about) ``recv_buffer_bytes``, or the largest the kernel allows"""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, recv_buffer_bytes)
+    except OSError:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer_bytes)
+    sock.bind((host, port))
+    sock.setblocking(False)
+
+    # Linux reports twice the size asked for, half of it being bookkeeping
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 2
+    if granted < recv_buffer_bytes:
+        logging.warning(
+            "UDP port %s: receive buffer capped at %d bytes (asked %d), "
+            "raise net.core.rmem_max to avoid drops",
+            port,
+            granted,
+            recv_buffer_bytes,
+        )
+    return sock
+
+
+def kernel_drops(sock: socket.socket) -> Optional[int]:
+    """Datagrams the kernel dropped on a socket because its receive buffer was full,
+    from /proc/net/udp (Linux), None where unavailable"""
+
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+        with open("/proc/net/udp", "r") as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class UdpPacketSource:
+    """Packet source receiving the lidar and IMU packets of a sensor on its UDP ports.
+
+    A receiver thread waits for the sockets to become readable and then drains them
+    with non-blocking receives, up to ``batch`` packets per socket at a time, straight
+    into packets of a preallocated ring of ``ring_packets``. Packets are handed over to
+    the consumer a batch at a time. When the consumer falls behind and the ring is
+    full, new packets are read and dropped (counted as userspace drops) so the kernel
+    buffers keep draining; drops in the kernel are read from /proc/net/udp.
+
+    As with client.Sensor, a yielded packet is only valid until the next one is
+    requested. Iterating raises ClientTimeout when no packet arrived for ``timeout``
+    seconds, if given."""
+
+    def __init__(
+        self,
+        metadata: SensorInfo,
+        lidar_port: int,
+        imu_port: int,
+        host: str = "",
+        recv_buffer_bytes: int = DEFAULT_RECV_BUFFER_BYTES,
+        ring_packets: int = 1024,
+        batch: int = DEFAULT_BATCH,
+        timeout: Optional[float] = 2.0,
+    ):
+        self._metadata = metadata
+        self._timeout = timeout
+        self._batch = batch
+        self._pf = _client.PacketFormat.from_info(metadata)
+
+        self._lidar_socket = open_udp_socket(host, lidar_port, recv_buffer_bytes)
+        self._imu_socket = open_udp_socket(host, imu_port, recv_buffer_bytes)
+        self.lidar_port = self._lidar_socket.getsockname()[1]
+        self.imu_port = self._imu_socket.getsockname()[1]
+
+        # IMU packets arrive ~100 times less often than lidar packets
+        self._free: Dict[type, Deque[Packet]] = {
+            LidarPacket: deque(
+                LidarPacket(packet_format=self._pf) for _ in range(ring_packets)
+            ),
+            ImuPacket: deque(
+                ImuPacket(packet_format=self._pf)
+                for _ in range(max(8, ring_packets // 16))
+            ),
+        }
+        self._sizes = {
+            LidarPacket: self._pf.lidar_packet_size,
+            ImuPacket: self._pf.imu_packet_size,
+        }
+        # Received into when the ring is full or a datagram has the wrong size
+        self._discard = bytearray(65536)
+
+        self._ready: Deque[Packet] = deque()
+        self._lock = threading.Lock()
+        self._received = threading.Condition(self._lock)
+        self._closed = threading.Event()
+
+        self.packets = 0
+        self.userspace_drops = 0
+        self.size_errors = 0
+
+        self._receiver = threading.Thread(
+            target=self._receive, name=f"udp-{self.lidar_port}", daemon=True
+        )
+        self._receiver.start()
+
+    @property
+    def metadata(self) -> SensorInfo:
+        """Metadata of the sensor the packets come from"""
+        return self._metadata
+
+    @property
+    def is_live(self) -> bool:
+        """Packets are received live"""
+        return True
+
+    def _read(self, sock: socket.socket, packet_type: type) -> List[Packet]:
+        # Drain up to one batch of datagrams from a readable socket
+        free = self._free[packet_type]
+        size = self._sizes[packet_type]
+        batch: List[Packet] = []
+        while len(batch) < self._batch:
+            with self._lock:
+                packet = free.popleft() if free else None
+            try:
+                if packet is None:
+                    sock.recv_into(self._discard)
+                    self.userspace_drops += 1
+                    continue
+                # A datagram larger than the packet is truncated and flagged
+                n, _, flags, _ = sock.recvmsg_into([packet._data])
+            except BlockingIOError:
+                if packet is not None:
+                    with self._lock:
+                        free.appendleft(packet)
+                break
+
+            if n != size or flags & socket.MSG_TRUNC:
+                self.size_errors += 1
+                with self._lock:
+                    free.appendleft(packet)
+                continue
+
+            packet.capture_timestamp = time.time()
+            batch.append(packet)
+        return batch
+
+    def _receive(self):
+        sockets = {
+            self._lidar_socket: LidarPacket,
+            self._imu_socket: ImuPacket,
+        }
+        while not self._closed.is_set():
+            readable, _, _ = select.select(list(sockets), [], [], POLL_INTERVAL_S)
+            for sock in readable:
+                batch = self._read(sock, sockets[sock])
+                if batch:
+                    with self._received:
+                        self._ready.extend(batch)
+                        self.packets += len(batch)
+                        self._received.notify()
+
+    def __iter__(self) -> Iterator[Packet]:
+        previous: Optional[Packet] = None
+        while True:
+            with self._received:
+                if previous is not None:
+                    # Consumed, its buffer can be received into again
+                    self._free[type(previous)].append(previous)
+                    previous = None
+                waited = 0.0
+                # Waits in short steps, a wait without timeout would not be
+                # interrupted by signals (Ctrl-C)
+                while not self._ready and not self._closed.is_set():
+                    if self._timeout is not None and waited >= self._timeout:
+                        raise ClientTimeout(
+                            f"No packets received within {self._timeout}s on UDP "
+                            f"ports {self.lidar_port}/{self.imu_port}"
+                        )
+                    self._received.wait(POLL_INTERVAL_S)
+                    waited += POLL_INTERVAL_S
+                if not self._ready:
+                    return
+                previous = self._ready.popleft()
+            yield previous
+
+    @property
+    def buf_use(self) -> int:
+        """Packets received and waiting to be consumed"""
+        return len(self._ready)
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """Packet counters: received, dropped in userspace (ring full) and by the
+        kernel (socket buffer full), datagrams of an unexpected size"""
+        return {
+            "udp_packets": self.packets,
+            "udp_userspace_drops": self.userspace_drops,
+            "udp_kernel_drops_lidar": kernel_drops(self._lidar_socket),
+            "udp_kernel_drops_imu": kernel_drops(self._imu_socket),
+            "udp_size_errors": self.size_errors,
+        }
+
+    def close(self):
+        """Stop receiving and close the sockets"""
+        self._closed.set()
+        with self._received:
+            self._received.notify_all()
+        self._receiver.join()
+        self._lidar_socket.close()
+        self._imu_socket.close()
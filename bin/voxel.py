@@ -0,0 +1,128 @@
+"""
+Voxel-grid downsampling of structured point arrays by sort-based binning
+"""
+
+from typing import Dict
+
+import numpy as np
+
+VOXEL_MODES = ("centroid", "first")
+
+# Bits per axis of a voxel key, three of them interleaved fit in 63 bits
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    # Insert two zero bits between each of the lower 21 bits of v
+    v = v & 0x1FFFFF
+    v = (v | v << 32) & 0x1F00000000FFFF
+    v = (v | v << 16) & 0x1F0000FF0000FF
+    v = (v | v << 8) & 0x100F00F00F00F00F
+    v = (v | v << 4) & 0x10C30C30C30C30C3
+    v = (v | v << 2) & 0x1249249249249249
+    return v
+
+
+def voxel_keys(points: np.ndarray, leaf_size: float) -> np.ndarray:
+    """Morton (Z-order) key of the voxel of every point. Interleaving the axes keeps
+    the keys of the 8 children of a voxel of twice the size contiguous, so shifting
+    the keys right by 3 bits yields the keys at twice the leaf size."""
+
+    keys = np.zeros(len(points), np.int64)
+    for axis, name in enumerate(("x", "y", "z")):
+        cell = np.floor(points[name] / leaf_size).astype(np.int64) + KEY_OFFSET
+        keys |= _spread_bits(cell) << axis
+    return keys
+
+
+def voxel_downsample(
+    points: np.ndarray, leaf_size: float, mode: str = "centroid"
+) -> np.ndarray:
+    """Reduce a structured points array to one point per occupied voxel of
+    ``leaf_size`` (meters): the centroid of the points in the voxel, every field
+    averaged, or the first of them in memory order. The result has the dtype of the
+    input and is ordered by voxel key."""
+
+    if mode not in VOXEL_MODES:
+        raise ValueError(f"Unknown voxel mode: {mode}")
+    if len(points) == 0 or leaf_size <= 0:
+        return points
+
+    keys = voxel_keys(points, leaf_size)
+
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.diff(sorted_keys, prepend=sorted_keys[0] - 1))
+
+    if mode == "first":
+        # The sort is not stable, the first point is the lowest index of each voxel
+        return points[np.minimum.reduceat(order, starts)]
+
+    counts = np.diff(np.append(starts, len(points)))
+    out = np.empty(len(starts), points.dtype)
+    for name in points.dtype.names:
+        sums = np.add.reduceat(points[name][order], starts, dtype=np.float64)
+        mean = sums / counts
+        if np.issubdtype(points.dtype[name], np.integer):
+            mean = np.rint(mean)
+        out[name] = mean
+    return out
+
+
+def voxel_downsample_levels(
+    points: np.ndarray, leaf_size: float, levels, mode: str = "centroid"
+) -> Dict[int, np.ndarray]:
+    """``voxel_downsample`` of the points at ``leaf_size`` times each of ``levels``
+    (integer factors), by level. The points are binned and sorted once, at the
+    finest level: a level a power of two coarser than it is binned by shifting the
+    sorted keys (see voxel_keys), its centroids summed up from those of the finer
+    voxels. Other levels are downsampled on their own."""
+
+    if mode not in VOXEL_MODES:
+        raise ValueError(f"Unknown voxel mode: {mode}")
+    if len(points) == 0 or leaf_size <= 0:
+        return {level: points for level in levels}
+
+    finest = min(levels)
+    keys = voxel_keys(points, leaf_size * finest)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.diff(sorted_keys, prepend=sorted_keys[0] - 1))
+
+    # Key and first point, or field sums and point count, of every finest voxel:
+    # the coarser voxels are made of them
+    finest_keys = sorted_keys[starts]
+    counts = np.diff(np.append(starts, len(points)))
+    firsts, sums = None, {}
+    if mode == "first":
+        # The sort is not stable, the first point is the lowest index of each voxel
+        firsts = np.minimum.reduceat(order, starts)
+    else:
+        sums = {
+            name: np.add.reduceat(points[name][order], starts, dtype=np.float64)
+            for name in points.dtype.names
+        }
+
+    out = {}
+    for level in levels:
+        ratio = level // finest
+        if level % finest or ratio & (ratio - 1):
+            out[level] = voxel_downsample(points, leaf_size * level, mode)
+            continue
+
+        level_keys = finest_keys >> 3 * (ratio.bit_length() - 1)
+        groups = np.flatnonzero(np.diff(level_keys, prepend=level_keys[0] - 1))
+        if mode == "first":
+            out[level] = points[np.minimum.reduceat(firsts, groups)]
+            continue
+
+        level_counts = np.add.reduceat(counts, groups)
+        level_points = np.empty(len(groups), points.dtype)
+        for name in points.dtype.names:
+            mean = np.add.reduceat(sums[name], groups) / level_counts
+            if np.issubdtype(points.dtype[name], np.integer):
+                mean = np.rint(mean)
+            level_points[name] = mean
+        out[level] = level_points
+    return out